@@ -51,7 +51,7 @@ scenario = ho.Scenario(power_plant, underlyings, name='base case')
 # Run optimization
 scenario.run()
 
-# ... wait about 30 seconds ...
+# ... takes well under a second ...
 
 # Plot results
 scenario.results_.plot()
\ No newline at end of file
@@ -1,6 +1,8 @@
 from hydropt.model import Basin, Outflow, Turbine, PowerPlant
 from hydropt.action import Standing, MinPower, MaxPower
 from hydropt.scenarios import Scenario, Underlyings
+from hydropt.batch import ScenarioBatch, ConstraintSweep
+from hydropt.rolling import RollingHorizon
 
 import importlib.resources as pkg_resources
 import pandas as pd
@@ -25,6 +25,25 @@ class PowerAction(BaseAction):
             constrained_power = power
             
         return constrained_power
+    
+    def nominal_power(self):
+        raise NotImplementedError
+    
+    def setpoints(self, constraints=None):
+        """Return the power of the turbine under the constraints and the 
+        power its flow rate is computed from.
+        """
+        power = self.constrain_power(constraints, self.nominal_power())
+        return power, power
+    
+    def turbine_power(self, constraints=None):
+        power, _ = self.setpoints(constraints)
+        num_plant_states = self.turbine.upper_basin.power_plant.num_states()
+        return power*np.ones((num_plant_states,))
+    
+    def flow_rates(self, constraints=None):
+        _, power = self.setpoints(constraints)
+        return self.turbine.flow_rate(power)
 
 
 class FixedPowerAction(PowerAction):
@@ -32,16 +51,11 @@ class FixedPowerAction(PowerAction):
         super().__init__(turbine)
         self.power = power
         
-    def turbine_power(self, constraints=None):
-        
-        power = self.constrain_power(constraints, self.power)
-        
-        num_plant_states = self.turbine.upper_basin.power_plant.num_states()
-        
-        return power*np.ones((num_plant_states,))
+    def nominal_power(self):
+        return self.power
     
-    def flow_rates(self, constraints=None):
-        return self.turbine.flow_rate(self.power)
+    def setpoints(self, constraints=None):
+        return self.constrain_power(constraints, self.power), self.power
     
     def __repr__(self):
         return f"{self.__class__.__name__}({self.turbine}, power={self.power})"
@@ -56,40 +70,16 @@ class MinPower(PowerAction):
     def __init__(self, turbine=None):
         super().__init__(turbine)
         
-    def turbine_power(self, constraints=None):
-        
-        power_min = self.constrain_power(constraints, 
-                                               self.turbine.base_load)
-            
-        num_plant_states = self.turbine.upper_basin.power_plant.num_states()
-        return power_min*np.ones((num_plant_states,))
-    
-    def flow_rates(self, constraints=None):
-        
-        power_min = self.constrain_power(constraints, 
-                                               self.turbine.base_load)
-        
-        return self.turbine.flow_rate(power_min)
+    def nominal_power(self):
+        return self.turbine.base_load
     
 
 class MaxPower(PowerAction):
     def __init__(self, turbine=None):
         super().__init__(turbine)
         
-    def turbine_power(self, constraints=None):
-        
-        power_max = self.constrain_power(constraints, 
-                                               self.turbine.max_power)
-            
-        num_plant_states = self.turbine.upper_basin.power_plant.num_states()
-        return power_max*np.ones((num_plant_states,))
-    
-    def flow_rates(self, constraints=None):
-        
-        power_max = self.constrain_power(constraints, 
-                                               self.turbine.max_power)
-        
-        return self.turbine.flow_rate(power_max)
+    def nominal_power(self):
+        return self.turbine.max_power
 
 
 class PowerPlantAction(list):
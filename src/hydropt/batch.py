@@ -0,0 +1,320 @@
+import copy
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from hydropt.scenarios import Scenario, Underlyings
+
+
+class SharedArray():
+    """Handle of a numpy array that is placed in shared memory. Only the 
+    handle is pickled when it is sent to another process.
+    """
+    
+    # shared memory blocks attached by this process (one per block)
+    _attached = {}
+    
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        
+        self.shape = array.shape
+        self.dtype = array.dtype
+        
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self._shm.name
+        
+        self.array()[...] = array
+        
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype, 'name': self.name}
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._shm = None
+        
+    def array(self):
+        """Return the array, which is backed by the shared memory."""
+        
+        shm = self._shm
+        if shm is None:
+            if self.name not in SharedArray._attached:
+                SharedArray._attached[self.name] = shared_memory.SharedMemory(name=self.name)
+            shm = SharedArray._attached[self.name]
+            
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+    
+    def release(self):
+        """Free the shared memory (only in the creating process)."""
+        
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+    
+
+class SharedUnderlyings():
+    """Underlyings whose arrays (time, price curves, inflow rates) are placed in
+    shared memory.
+    """
+    
+    def __init__(self, underlyings):
+        self._attributes = {}
+        
+        for name, value in vars(underlyings).items():
+            if isinstance(value, np.ndarray):
+                value = SharedArray(value)
+            self._attributes[name] = value
+            
+    def attach(self):
+        """Return Underlyings that use the arrays in shared memory."""
+        
+        underlyings = Underlyings.__new__(Underlyings)
+        for name, value in self._attributes.items():
+            if isinstance(value, SharedArray):
+                value = value.array()
+            setattr(underlyings, name, value)
+            
+        return underlyings
+    
+    def release(self):
+        for value in self._attributes.values():
+            if isinstance(value, SharedArray):
+                value.release()
+
+
+class ScenarioResult():
+    """Compact result of a scenario that has been run in another process."""
+    
+    def __init__(self, name, turbine_actions, basin_actions, volume, 
+                 valuation, run_time, steps_solved=None):
+        self.name = name
+        self.turbine_actions = turbine_actions
+        self.basin_actions = basin_actions
+        self.volume = volume
+        self.valuation = valuation
+        self.run_time = run_time
+        self.steps_solved = steps_solved
+        
+    def __repr__(self):
+        return (f"{self.__class__.__name__}('{self.name}', "
+                f"valuation={self.valuation}, run_time={self.run_time:.1f}s)")
+
+
+def _run_scenario(scenario, underlyings, run_kwargs):
+    """Run a scenario in a worker process."""
+    
+    t_start = time.time()
+    
+    scenario.underlyings = underlyings.attach()
+    scenario.run(**run_kwargs)
+    
+    return ScenarioResult(
+        scenario.name,
+        scenario.turbine_actions_,
+        scenario.basin_actions_,
+        scenario.volume_,
+        scenario.valuation(),
+        time.time()-t_start)
+
+
+def print_progress(done, total, result):
+    print(f"[{done}/{total}] {result.name}: {result.valuation} "
+          f"({result.run_time:.1f}s)")
+
+
+class ScenarioBatch():
+    """Runs many scenarios on a pool of processes.
+    
+    The arrays of the underlyings are placed in shared memory once (per 
+    Underlyings object) instead of being pickled for each scenario. Only the 
+    dispatch of each scenario is sent back and set on the scenario, the 
+    action and value grids are dropped.
+    """
+    
+    def __init__(self, scenarios, n_workers=None, progress=print_progress):
+        self.scenarios = list(scenarios)
+        self.n_workers = n_workers
+        self.progress = progress
+        
+        self.results_ = None
+        
+    def run(self, **run_kwargs):
+        """Run all scenarios. Keyword arguments are passed to Scenario.run."""
+        
+        shared = {}
+        tasks = []
+        
+        try:
+            for scenario in self.scenarios:
+                
+                if id(scenario.underlyings) not in shared:
+                    shared[id(scenario.underlyings)] = SharedUnderlyings(scenario.underlyings)
+                
+                # send the inputs of the scenario only
+                task = copy.copy(scenario)
+                for name in list(vars(task)):
+                    if name.endswith('_'):
+                        delattr(task, name)
+                task.underlyings = None
+                
+                tasks.append((task, shared[id(scenario.underlyings)]))
+                
+            results = len(tasks)*[None]
+                
+            with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+                futures = {executor.submit(_run_scenario, task, underlyings, run_kwargs): k 
+                           for k, (task, underlyings) in enumerate(tasks)}
+                
+                for done, future in enumerate(as_completed(futures), start=1):
+                    k = futures[future]
+                    results[k] = future.result()
+                    
+                    self.scenarios[k].set_dispatch(results[k].turbine_actions,
+                                                   results[k].basin_actions,
+                                                   results[k].volume)
+                    
+                    if self.progress is not None:
+                        self.progress(done, len(tasks), results[k])
+        finally:
+            for underlyings in shared.values():
+                underlyings.release()
+                
+        self.results_ = results
+        
+    def valuation(self, base=None):
+        """Return a table with the valuation of each scenario. If the index of
+        a base scenario is given, the opportunity costs (valuation of the base
+        minus valuation of the scenario) are added.
+        """
+        
+        if self.results_ is None:
+            raise RuntimeError('Need to run batch first.')
+            
+        names = [result.name if result.name is not None else k 
+                 for k, result in enumerate(self.results_)]
+        values = np.array([result.valuation for result in self.results_])
+        
+        if values.ndim > 1:
+            columns = [f'valuation {k}' for k in range(values.shape[1])]
+        else:
+            columns = ['valuation']
+            
+        table = pd.DataFrame(values.reshape(len(names), -1), index=names, columns=columns)
+        
+        if base is not None:
+            base_values = table.iloc[base].to_numpy()
+            for column, base_value in zip(columns, base_values):
+                table[column.replace('valuation', 'opportunity cost')] = base_value - table[column]
+                
+        return table
+
+
+class ConstraintSweep():
+    """Prices many candidate constraint sets (e.g. ancillary service 
+    commitments) against a base scenario.
+    
+    Each constraint set is optimized as a variant of the base scenario. The 
+    variants reuse the solution of the base scenario for all steps after 
+    their last constrained step (see Scenario.run) and share the core actions
+    and transition operators of steps with identical constraints. Constraint 
+    sets that change no step of the horizon (e.g. empty ones) are not solved 
+    at all. The variants are run on a pool of threads, which allows sharing 
+    the operators in memory. Only the valuation of each variant is kept.
+    """
+    
+    def __init__(self, base, constraint_sets, names=None, n_workers=None,
+                 progress=print_progress):
+        self.base = base
+        self.constraint_sets = list(constraint_sets)
+        
+        if names is None:
+            names = ['+'.join(constraint.name for constraint in constraints) or str(k)
+                     for k, constraints in enumerate(self.constraint_sets)]
+        self.names = list(names)
+        
+        self.n_workers = n_workers
+        self.progress = progress
+        
+        self.results_ = None
+        
+    def _run_variant(self, constraints, name, run_kwargs):
+        
+        t_start = time.time()
+        
+        base = self.base
+        scenario = Scenario(base.power_plant, base.underlyings, constraints,
+                            water_value_end=base.water_value_end,
+                            basin_limit_penalty=base.basin_limit_penalty,
+                            name=name, dtype=base.dtype)
+        
+        # the action lists of the variant are added to a copy, i.e. they are
+        # dropped with the variant
+        scenario.run(base=base, core_actions=dict(self._core_actions), **run_kwargs)
+        
+        # the grids of the variant are dropped
+        return ScenarioResult(
+            name,
+            scenario.turbine_actions_,
+            scenario.basin_actions_,
+            scenario.volume_,
+            scenario.valuation(),
+            time.time()-t_start,
+            scenario.steps_solved_)
+        
+    def run(self, **run_kwargs):
+        """Run the base scenario (if needed) and all variants. Keyword 
+        arguments are passed to Scenario.run.
+        """
+        
+        base = self.base
+        
+        if getattr(base, 'value_grid_', None) is None:
+            base.run(**run_kwargs)
+            
+        # operators of the base are shared with all variants
+        self._core_actions = getattr(base, 'core_actions_', None) or {}
+            
+        results = len(self.constraint_sets)*[None]
+        
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = {executor.submit(self._run_variant, constraints, name, run_kwargs): k 
+                       for k, (constraints, name) in enumerate(zip(self.constraint_sets, 
+                                                                   self.names))}
+            
+            for done, future in enumerate(as_completed(futures), start=1):
+                k = futures[future]
+                results[k] = future.result()
+                
+                if self.progress is not None:
+                    self.progress(done, len(results), results[k])
+                    
+        self.results_ = results
+        
+    def opportunity_costs(self):
+        """Return a table with the valuation and the opportunity costs 
+        (valuation of the base minus valuation of the variant) of each 
+        constraint set, as well as the number of steps that were solved.
+        """
+        
+        if self.results_ is None:
+            raise RuntimeError('Need to run sweep first.')
+            
+        base_value = np.atleast_1d(self.base.valuation())
+        values = np.array([result.valuation for result in self.results_])
+        values = values.reshape((len(self.results_), -1))
+        
+        if values.shape[1] > 1:
+            suffixes = [f' {k}' for k in range(values.shape[1])]
+        else:
+            suffixes = ['']
+        
+        table = pd.DataFrame(index=self.names)
+        for k, suffix in enumerate(suffixes):
+            table['valuation' + suffix] = values[:, k]
+            table['opportunity cost' + suffix] = base_value[k] - values[:, k]
+        table['steps solved'] = [result.steps_solved for result in self.results_]
+        
+        return table
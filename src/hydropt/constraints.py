@@ -1,3 +1,4 @@
+import bisect
 import functools
 
 import numpy as np
@@ -122,53 +123,98 @@ class TurbineConstraint():
             
                 
 class ConstraintsSeries():
-    def __init__(self, time_start, time_end, constraints=None):
+    """Constraints of each time step. The time steps start at time, which 
+    defaults to the steps between time_start and time_end in the unit of 
+    time_start (e.g. hours). A constraint applies to the steps starting in 
+    [constraint.time_start, constraint.time_end).
+    
+    The constraints are kept as run-length segments of steps with the same 
+    constraints, found by a sweep over the start and end steps of the 
+    constraints. Overlapping constraints of a turbine are added once per 
+    segment. The steps of a segment share the same dict of constraints.
+    """
+    
+    def __init__(self, time_start, time_end, constraints=None, time=None):
         
         self._time_start = np.datetime64(time_start)
         self._time_end =  np.datetime64(time_end)
         
-        self._time = np.arange(self._time_start, self._time_end)
-       
-        indices = np.arange(len(self._time))
-        
-        self._data = [{} for i in indices]
+        if time is None:
+            self._time = np.arange(self._time_start, self._time_end)
+        else:
+            self._time = np.asarray(time)
         
         if constraints is None:
             constraints = []
-        
-        for constraint in constraints:
-            ind = indices[(self._time>=constraint.time_start) & (self._time<constraint.time_end)]
             
-            for i in ind:
-                
-                const_dict = self._data[i]
-                
-                if constraint.turbine in const_dict:
-                    const_dict[constraint.turbine] += constraint
-                else:
-                    const_dict[constraint.turbine] = constraint
-                    
-    def normalized(self, turbines):
-        normalized_data = []
+        self._segments = self._sweep(list(constraints))
+        self._data = None
         
-        for constraints in self._data:
-            
-            normalized_constraints = {}
+    def _sweep(self, constraints):
+        """Return the segments (start, stop, constraints) of the steps."""
+        
+        n_steps = len(self._time)
+        
+        # first step of each constraint and first step after it
+        unit = np.result_type(self._time.dtype, 
+                              *[np.datetime64(time).dtype for constraint in constraints 
+                                for time in (constraint.time_start, constraint.time_end)])
+        time = self._time.astype(unit)
+        starts = np.searchsorted(time, np.array([c.time_start for c in constraints], dtype=unit))
+        stops = np.searchsorted(time, np.array([c.time_end for c in constraints], dtype=unit))
+        
+        events = {0: [], n_steps: []}
+        for index, (start, stop) in enumerate(zip(starts, stops)):
+            if start < stop:
+                events.setdefault(start, []).append(index)
+                events.setdefault(stop, []).append(index)
+        
+        segments = []
+        active = set()
+        bounds = sorted(events)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            active ^= set(events[start])
             
-            for turbine in turbines:
-                
-                if turbine in constraints:
-                    
-                    normalized_constraints[turbine] = constraints[turbine]
-                    
+            # constraints are added in the order they are given
+            merged = {}
+            for index in sorted(active):
+                constraint = constraints[index]
+                if constraint.turbine in merged:
+                    merged[constraint.turbine] += constraint
                 else:
+                    merged[constraint.turbine] = constraint
                     
-                    normalized_constraints[turbine] = TurbineConstraint(
-                        turbine, self.time_start, self.time_end)
-                    
-            normalized_data.append(normalized_constraints)
+            if segments and _key(segments[-1][2]) == _key(merged):
+                segments[-1] = (segments[-1][0], stop, segments[-1][2])
+            else:
+                segments.append((start, stop, merged))
+                
+        # first step of each segment, to look up the segment of a step
+        self._starts = [start for start, _, _ in segments]
+        
+        return segments
+    
+    def segments(self):
+        """Segments (start, stop, constraints) of steps start to stop 
+        (excluded) with the same constraints.
+        """
+        return list(self._segments)
+    
+    def normalized_segments(self, turbines):
+        """Segments (start, stop, constraints) with a constraint for each of 
+        the turbines, which is the default (unconstrained) one for turbines 
+        without constraints.
+        """
+        
+        defaults = {turbine: TurbineConstraint(turbine, self.time_start, self.time_end)
+                    for turbine in turbines}
+        
+        return [(start, stop, {turbine: constraints.get(turbine, defaults[turbine]) 
+                               for turbine in turbines})
+                for start, stop, constraints in self._segments]
                     
-        return normalized_data
+    def normalized(self, turbines):
+        return _expand(self.normalized_segments(turbines))
                     
     @property
     def time(self):
@@ -176,6 +222,9 @@ class ConstraintsSeries():
     
     @property
     def data(self):
+        # expanded once, the steps share the dicts of their segments anyway
+        if self._data is None:
+            self._data = _expand(self._segments)
         return self._data
     
     @property
@@ -187,10 +236,26 @@ class ConstraintsSeries():
         return self._time_end
     
     def __getitem__(self, index):
-        return self._data[index]
+        if isinstance(index, slice):
+            return self.data[index]
+        
+        # segment of the step
+        step = range(len(self._time))[index]
+        segment = bisect.bisect_right(self._starts, step) - 1
+        return self._segments[segment][2]
     
     def __iter__(self):
-        return iter(self._data)
+        return iter(self.data)
+    
+    
+def _key(constraints):
+    return {turbine: tuple(constraint) for turbine, constraint in constraints.items()}
+
+
+def _expand(segments):
+    """List of the constraints of each step of the segments."""
+    return [constraints for start, stop, constraints in segments 
+            for _ in range(start, stop)]
     
     
             
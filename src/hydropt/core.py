@@ -1,3 +1,8 @@
+import collections
+import copy
+import hashlib
+import threading
+
 import numpy as np
 import scipy.sparse as sparse
 
@@ -30,12 +35,10 @@ def simple_trans_matrix(V, num_states, q):
 
 
 def kron_index(num_states, position):
-    n = num_states[position]
-    rep_d1 = np.prod(num_states[0:position], dtype=np.int)
-    rep_d2 = np.prod(num_states[position:], dtype=np.int)//n
-    
-    index_rep = np.tile(np.arange(n), (rep_d2, rep_d1))
-    return index_rep.flatten('F')
+    """State index of basin position at each joint state (as int64, see 
+    StateSpace.index for the shared compact array).
+    """
+    return StateSpace.get(num_states).index(position).astype(np.int64)
 
 
 def kron_indices(num_states, positions):
@@ -52,8 +55,293 @@ def kron_basis_map(num_states):
     return np.flip(np.cumprod(np.flip(num_states)))//num_states
 
 
+class StateSpace():
+    """Joint states of the basins, i.e. the Kronecker product of the states of
+    the basins (the states of the last basin vary fastest).
+    
+    The strides and the state index of each basin at each joint state are 
+    computed once (on first use) and kept in the smallest unsigned integer 
+    type, which is read-only and must be cast before arithmetic that may 
+    leave its range. StateSpace.get shares the state spaces of the most 
+    recently used grids between the model, the solver and the forward pass.
+    """
+    
+    _instances = collections.OrderedDict()
+    _lock = threading.Lock()
+    max_instances = 8
+    
+    def __init__(self, num_states):
+        self.num_states = np.int64(np.round(num_states))
+        self.shape = tuple(int(n) for n in self.num_states)
+        self.size = int(np.prod(self.shape))
+        self.strides = kron_basis_map(self.num_states)
+        
+        self.index_dtype = np.min_scalar_type(max(self.shape)-1)
+        self._index = [None]*len(self.shape)
+        self._states = None
+        
+    @classmethod
+    def get(cls, num_states):
+        """Return the shared state space of the grid num_states."""
+        
+        key = tuple(int(n) for n in np.round(num_states))
+        with cls._lock:
+            if key in cls._instances:
+                cls._instances.move_to_end(key)
+                return cls._instances[key]
+            
+            space = cls._instances[key] = cls(key)
+            while len(cls._instances) > cls.max_instances:
+                cls._instances.popitem(last=False)
+            return space
+        
+    def index(self, basin):
+        """State index of the basin at each joint state."""
+        
+        if self._index[basin] is None:
+            shape = [1]*len(self.shape)
+            shape[basin] = -1
+            index = np.arange(self.shape[basin], dtype=self.index_dtype).reshape(shape)
+            index = np.ascontiguousarray(np.broadcast_to(index, self.shape)).ravel()
+            index.flags.writeable = False
+            self._index[basin] = index
+            
+        return self._index[basin]
+    
+    def indices(self):
+        """State indices of all basins as (joint states x basins) array."""
+        return np.stack([self.index(k) for k in range(len(self.shape))], axis=1)
+    
+    def states(self):
+        """Joint state indices (int64)."""
+        
+        if self._states is None:
+            states = np.arange(self.size, dtype=np.int64)
+            states.flags.writeable = False
+            self._states = states
+            
+        return self._states
+    
+    def ravel(self, index):
+        """Joint state of the basin state indices (of shape (..., basins))."""
+        return np.dot(np.asarray(index, dtype=np.int64), self.strides)
+    
+    def unravel(self, state):
+        """Basin state indices (of shape (..., basins)) of joint states."""
+        return np.asarray(state, dtype=np.int64)[..., None]//self.strides % self.num_states
+    
+    def volume_grid(self, volume):
+        """Volume of each basin at each joint state as (basins x joint 
+        states) array.
+        """
+        return np.array([volume[k]*np.linspace(0, 1, n)[self.index(k)] 
+                         for k, n in enumerate(self.shape)])
+    
+    def box(self, lo, hi):
+        """Sorted joint states of the box of basin states lo to hi (inclusive)."""
+        ranges = np.meshgrid(*[np.arange(l, h+1) for l, h in zip(lo, hi)], indexing='ij')
+        return np.ravel_multi_index(ranges, self.shape).ravel()
+
+
+def cache_nbytes(entry):
+    """Approximate memory of a cache entry in bytes: the arrays of sparse 
+    matrices and ndarrays, and the nbytes attribute of other objects.
+    """
+    
+    if sparse.issparse(entry):
+        return sum(getattr(entry, name).nbytes 
+                   for name in ('data', 'indices', 'indptr', 'offsets', 'row', 'col')
+                   if hasattr(entry, name))
+    return getattr(entry, 'nbytes', 0)
+
+
+class OperatorCache():
+    """Keyed cache for transition operators and quantities derived from them.
+    
+    Hits and misses are counted such that the effectiveness of the cache can 
+    be inspected after a run.
+    
+    If max_bytes is given, the least recently used entries are evicted once 
+    the entries take more than max_bytes (see cache_nbytes). Entries larger 
+    than max_bytes are not stored. The cache can be shared between threads, 
+    the factories are called outside of its lock.
+    """
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def get(self, key, factory):
+        """Return the entry stored under key. If there is none, it is created
+        by calling factory() and stored.
+        """
+        
+        with self._lock:
+            if key in self._data:
+                self.hits += 1
+                self._data.move_to_end(key)
+                return self._data[key][0]
+            self.misses += 1
+            
+        entry = factory()
+        nbytes = cache_nbytes(entry) if self.max_bytes is not None else 0
+        
+        with self._lock:
+            if key in self._data:
+                # created by another thread in the meantime
+                return self._data[key][0]
+            
+            if self.max_bytes is None or nbytes <= self.max_bytes:
+                self._data[key] = (entry, nbytes)
+                self.nbytes += nbytes
+                self._evict()
+                
+        return entry
+    
+    def _evict(self):
+        while self.max_bytes is not None and self.nbytes > self.max_bytes:
+            _, (_, nbytes) = self._data.popitem(last=False)
+            self.nbytes -= nbytes
+            self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+        
+    def __len__(self):
+        return len(self._data)
+    
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(entries={len(self)}, "
+                f"nbytes={self.nbytes}, hits={self.hits}, misses={self.misses}, "
+                f"evictions={self.evictions})")
+
+
+# process-wide cache of the transition operators of the core actions, which
+# shares them between scenarios (and plants) with the same state grid
+TRANSITION_CACHE = OperatorCache(max_bytes=2**30)
+
+# basin flows are quantised to this fraction of the volume between two states
+# for the keys of TRANSITION_CACHE
+FLOW_QUANTUM = 1e-9
+
+
+OPERATORS = ('sparse', 'stacked', 'tensor', 'banded')
+
+# operators that are based on scipy.sparse matrices
+SPARSE_OPERATORS = ('sparse', 'stacked')
+
+
+def check_operator(operator):
+    if operator not in OPERATORS:
+        raise ValueError(f"Operator '{operator}' not implemented. "
+                         f"Choose from the following operators {list(OPERATORS)}")
+
+
+def mass_leakage(mass, dtype=np.float64):
+    """Probability mass 1 - mass leaving the basin limits. Below double 
+    precision, the rounding errors of the operators would be amplified by the
+    basin limit penalty, hence leakage at their level is set to zero.
+    """
+    
+    leakage = 1 - mass
+    if np.dtype(dtype) != np.float64:
+        leakage[np.abs(leakage) < 16*np.finfo(dtype).eps] = 0
+    return leakage.astype(dtype, copy=False)
+
+
+class InflowOperator():
+    """Transition operator for the inflow of a single time step together with 
+    its column sums, i.e. the probability mass that stays within the basin 
+    limits. The leakage of the combined (inflow, action) operators is derived
+    from the latter and cached per action.
+    """
+    
+    def __init__(self, volume, num_states, inflow, operator='sparse', 
+                 dtype=np.float64):
+        check_operator(operator)
+        
+        self.dtype = np.dtype(dtype)
+        
+        if operator in SPARSE_OPERATORS:
+            L_inflow = simple_trans_matrix(volume, num_states, -inflow)
+            # transposed operator (csr) as it is only ever applied from the left
+            self.matrix_T = L_inflow.T.tocsr().astype(dtype)
+        else:
+            self.matrix_T = None
+            self._tensor = TensorTransition(volume, num_states, -inflow, dtype)
+            
+        self.mass = self.propagate(np.ones((np.prod(num_states), ), dtype=dtype))
+        
+        self._leakage = {}
+        
+    def propagate(self, value):
+        if self.matrix_T is None:
+            return self._tensor.propagate(value)
+        return self.matrix_T.dot(value)
+    
+    def leakage(self, action):
+        """Probability mass leaving the basin limits when the inflow is 
+        followed by the given action, i.e. 1 - column sums of 
+        L_inflow @ action.trans_matrix().
+        """
+        
+        if action not in self._leakage:
+            self._leakage[action] = mass_leakage(action.propagate(self.mass), self.dtype)
+            
+        return self._leakage[action]
+    
+    @property
+    def nbytes(self):
+        if self.matrix_T is None:
+            operator_nbytes = self._tensor.nbytes
+        else:
+            operator_nbytes = cache_nbytes(self.matrix_T)
+        return (operator_nbytes + self.mass.nbytes
+                + sum(leakage.nbytes for leakage in self._leakage.values()))
+    
+    @staticmethod
+    def key(volume, num_states, inflow, operator='sparse', dtype=np.float64):
+        return (np.asarray(volume, dtype=np.float64).tobytes(), 
+                np.asarray(num_states, dtype=np.int64).tobytes(),
+                np.asarray(inflow, dtype=np.float64).tobytes(),
+                operator,
+                np.dtype(dtype).str)
+
+
+def csr_rows_dot(matrix, rows, value):
+    """Compute matrix[rows] @ value for a csr matrix and sorted rows. The 
+    product is computed for the contiguous range of rows from rows[0] to 
+    rows[-1] without copying the matrix.
+    """
+    
+    start, stop = rows[0], rows[-1] + 1
+    indptr = matrix.indptr[start:stop+1]
+    block = sparse.csr_matrix(
+        (matrix.data[indptr[0]:indptr[-1]], matrix.indices[indptr[0]:indptr[-1]],
+         indptr - indptr[0]), 
+        shape=(stop-start, matrix.shape[1]), copy=False)
+    return block.dot(value)[rows - start]
+
+
 class CoreAction():
-    def __init__(self, turbine_action, basin_action, volumes, num_states):
+    """Action of the power plant with its transition operator, which is taken
+    from cache (TRANSITION_CACHE by default) and shared with all actions with
+    the same basin flows on the same state grid.
+    """
+    
+    def __init__(self, turbine_action, basin_action, volumes, num_states,
+                 operator='sparse', dtype=np.float64, cache=None):
+        check_operator(operator)
         
         self.turbine_action = turbine_action
         self.basin_action = basin_action
@@ -61,93 +349,904 @@ class CoreAction():
         self.volumes = volumes
         self.num_states = num_states
         
+        self.operator = operator
+        self.dtype = np.dtype(dtype)
+        
+        self.cache = cache
+        
         self._trans_matrix = None
+        self._trans_matrix_T = None
+        self._tensor_operator = None
+        
+    def key(self, kind):
+        """Key of the operator of the given kind in the cache, built from the
+        state grid and the basin flows quantised to FLOW_QUANTUM states.
+        """
+        
+        volumes = np.asarray(self.volumes, dtype=np.float64)
+        num_states = np.asarray(self.num_states, dtype=np.int64)
+        dvols = volumes/(num_states-1)
+        basin_action = np.asarray(self.basin_action, dtype=np.float64)
+        flows = np.int64(np.round(
+            basin_action/dvols.reshape((-1, ) + (1, )*(basin_action.ndim-1))/FLOW_QUANTUM))
+        
+        return (kind, volumes.tobytes(), num_states.tobytes(), flows.shape,
+                hashlib.blake2b(flows.tobytes()).digest(), self.dtype.str)
+        
+    def _cached(self, kind, factory):
+        cache = TRANSITION_CACHE if self.cache is None else self.cache
+        return cache.get(self.key(kind), factory)
         
     def trans_matrix(self):
         
         if self._trans_matrix is None:
-            self._trans_matrix = trans_matrix(self.volumes, self.num_states, self.basin_action)
+            self._trans_matrix = self._cached(
+                'matrix',
+                lambda: trans_matrix(self.volumes, self.num_states, 
+                                     self.basin_action).astype(self.dtype))
         
         return self._trans_matrix
+    
+    def trans_matrix_T(self):
+        """Transposed transition matrix (csr), which shares the data of 
+        trans_matrix().
+        """
+        
+        if self._trans_matrix_T is None:
+            self._trans_matrix_T = self.trans_matrix().T
+            
+        return self._trans_matrix_T
+    
+    def tensor_operator(self):
+        
+        if self._tensor_operator is None:
+            self._tensor_operator = self._cached(
+                'tensor',
+                lambda: TensorTransition(self.volumes, self.num_states, 
+                                         self.basin_action, self.dtype))
+            
+        return self._tensor_operator
+    
+    def build(self):
+        """Build the transition operator that is used by propagate."""
+        if self.operator in SPARSE_OPERATORS:
+            self.trans_matrix()
+        else:
+            self.tensor_operator()
+    
+    def propagate(self, value, states=None):
+        """Compute trans_matrix().T @ value, restricted to the given states 
+        (an index array) if they are given.
+        """
+        if self.operator in SPARSE_OPERATORS:
+            if states is None:
+                return self.trans_matrix_T().dot(value)
+            return csr_rows_dot(self.trans_matrix_T(), states, value)
+        if states is None:
+            return self.tensor_operator().propagate(value)
+        return self.tensor_operator().propagate(value)[states]
+        
+
+class StackedActionSet():
+    """Transition operators of all actions stacked into one block operator.
+    
+    The transposed transition matrices of the actions are stacked vertically,
+    such that a single sparse product yields the future rewards of all 
+    actions as an (actions x states) array.
+    """
+    
+    def __init__(self, actions, n_blocks=1):
+        self.actions = actions
+        
+        # the actions are split into n_blocks blocks of rows, which can be 
+        # evaluated independently of each other
+        self.blocks = []
+        for indices in np.array_split(np.arange(len(actions)), 
+                                      min(n_blocks, len(actions))):
+            matrix_T = sparse.vstack(
+                [actions[k].trans_matrix().T for k in indices], format='csr')
+            self.blocks.append((slice(indices[0], indices[-1]+1), matrix_T))
+        
+        # generated power of each action and state, summed over all turbines
+        self.power = np.array([np.sum(action.turbine_action, axis=0) 
+                               for action in actions], dtype=actions[0].dtype)
+        
+    def propagate(self, value, block=None, states=None):
+        """Compute L.T @ value for the operators L of all actions. Returns an 
+        (actions x states) array. If a block (an element of blocks) is given, 
+        only the rows of its actions are computed. If states (an index array)
+        are given, only these states are computed.
+        """
+        
+        if block is None:
+            n_states = self.power.shape[1] if states is None else len(states)
+            out = np.empty((len(self.power), n_states) + value.shape[1:], 
+                           dtype=value.dtype)
+            for block in self.blocks:
+                out[block[0]] = self.propagate(value, block, states)
+            return out
+        
+        rows, matrix_T = block
+        shape = self.power[rows].shape
+        if states is None:
+            return matrix_T.dot(value).reshape(shape + value.shape[1:])
+        
+        # rows of the states in the stacked operator of each action
+        return np.stack([csr_rows_dot(matrix_T, k*shape[1] + states, value) 
+                         for k in range(shape[0])])
+        
+
+def banded_terms(volume, num_states, q):
+    """Target state indices and weights of the floor/ceil transitions of a 
+    single basin. The throughput q has the basin states along its last axis.
+    """
+    
+    dvols = volume/(num_states-1)
+    
+    # compute state indices change (interpolate -> floor/ceil)
+    dk_floor = np.int64(q/dvols)
+    dk_ceil = np.int64(dk_floor + np.sign(q))
+    # compute weights
+    p_ceil = (np.abs(q) % dvols)/dvols
+    
+    index = np.arange(num_states)
+    
+    terms = []
+    for dk, p in ((dk_floor, 1-p_ceil), (dk_ceil, p_ceil)):
+        # compute target state indices and make sure they are not out of bound
+        k_target = index - dk
+        valid = (k_target < num_states) & (k_target >= 0)
+        terms.append((np.clip(k_target, 0, num_states-1), np.where(valid, p, 0)))
+        
+    return terms
+
+
+class BandedActionSet():
+    """Transition operators of all actions of a single-basin plant, optionally 
+    preceded by the inflow of a time step.
+    
+    With a single basin every transition matrix is banded with two diagonals
+    (floor/ceil). The combined operators of all actions are stored as 
+    (actions x states) arrays of target indices and weights, such that all 
+    actions are evaluated with one array operation and without scipy.sparse.
+    """
+    
+    def __init__(self, actions, inflow=None):
+        self.actions = actions
         
+        volume = actions[0].volumes[0]
+        n = int(actions[0].num_states[0])
+        
+        q = np.array([np.broadcast_to(action.basin_action[0], (n, ))
+                      for action in actions], dtype=np.float64)
+        
+        terms = banded_terms(volume, n, q)
+        
+        if inflow is not None:
+            # (L_inflow @ L_action).T @ v: the targets of the action are 
+            # followed by the targets of the inflow
+            inflow_terms = banded_terms(volume, n, -inflow[0]*np.ones((n, )))
+            terms = [(k_inflow[k], p*p_inflow[k]) 
+                     for k, p in terms for k_inflow, p_inflow in inflow_terms]
+            
+        dtype = actions[0].dtype
+        self._terms = [(k, p.astype(dtype)) for k, p in terms]
+        
+        # probability mass leaving the basin limits
+        self.leakage = mass_leakage(sum(p for _, p in terms), dtype)
+        
+        # generated power of each action and state, summed over all turbines
+        self.power = np.array([np.sum(action.turbine_action, axis=0) 
+                               for action in actions], dtype=dtype)
+        
+    def propagate(self, value, states=slice(None)):
+        """Compute L.T @ value for the operators L of all actions. Returns an 
+        (actions x states) array, which is restricted to the given states. 
+        Additional axes of value (e.g. price curves) are appended.
+        """
+        
+        # weights are broadcast along the additional axes of value
+        expand = (slice(None), states) + (None, )*(value.ndim-1)
+        return sum(p[expand]*value[k[:, states]] for k, p in self._terms)
+    
+    @property
+    def nbytes(self):
+        return (sum(k.nbytes + p.nbytes for k, p in self._terms) 
+                + self.leakage.nbytes + self.power.nbytes)
+        
+
+class OperatorPipeline():
+    """Bounded producer/consumer pipeline for the operators of the action 
+    lists in action_series.
+    
+    The unique action lists are ordered by their first use in the backward 
+    induction. If an executor is given, the operators of up to depth upcoming
+    action lists are built ahead of time on its worker threads while the 
+    current step is evaluated. Without executor, operators are built on first
+    use. The number of times the consumer had to wait for an operator that 
+    was still under construction is counted in waits.
+    """
+    
+    def __init__(self, action_series, build, executor=None, depth=2):
+        self.build = build
+        self.executor = executor
+        self.depth = depth
+        
+        self.waits = 0
+        
+        self._upcoming = collections.deque()
+        seen = set()
+        for actions in reversed(action_series):
+            if id(actions) not in seen:
+                seen.add(id(actions))
+                self._upcoming.append(actions)
+                
+        self._pending = {}
+        self._built = {}
+        
+        self._submit()
+        
+    def _submit(self):
+        if self.executor is None:
+            return
+        
+        while self._upcoming and len(self._pending) < self.depth:
+            actions = self._upcoming.popleft()
+            if id(actions) not in self._built:
+                self._pending[id(actions)] = self.executor.submit(self.build, actions)
+            
+    def get(self, actions):
+        """Return the operator of actions, which blocks only if it is not 
+        built yet.
+        """
+        
+        key = id(actions)
+        
+        if key not in self._built:
+            
+            if key in self._pending:
+                future = self._pending.pop(key)
+                if not future.done():
+                    self.waits += 1
+                self._built[key] = future.result()
+            else:
+                self._built[key] = self.build(actions)
+                
+            self._submit()
+            
+        return self._built[key]
+
+
+def _floor(x):
+    return np.floor(x - 1e-9)
+
+
+def _ceil(x):
+    return np.ceil(x + 1e-9)
+
+
+def reachable_band(volume, num_states, start_volumes, action_series, inflows):
+    """Ranges of the state indices of each basin that can be reached from the
+    start volumes, as (n_steps+1, basins) arrays lo and hi (inclusive). The 
+    transitions of the backward induction from states within the ranges of a
+    step, as well as the rounded volumes of the forward propagation, stay
+    within the ranges of the next step.
+    """
+    
+    num_states = np.asarray(num_states)
+    dvols = np.asarray(volume)/(num_states-1)
+    n_steps = len(action_series)
+    
+    lo = np.empty((n_steps+1, len(num_states)), dtype=np.int64)
+    hi = np.empty((n_steps+1, len(num_states)), dtype=np.int64)
+    lo[0] = hi[0] = np.round(np.asarray(start_volumes)/dvols)
+    
+    # range of the outflow (in states) of each list of actions
+    outflows = {}
+    
+    for step, actions in enumerate(action_series):
+        if id(actions) not in outflows:
+            q = np.concatenate([action.basin_action.reshape((len(num_states), -1)) 
+                                for action in actions], axis=1)
+            outflows[id(actions)] = (q.min(axis=1)/dvols, q.max(axis=1)/dvols, actions)
+        out_min, out_max, _ = outflows[id(actions)]
+        inflow = inflows[step]/dvols
+        
+        # floor/ceil transitions of the action followed by the inflow, and 
+        # rounded volumes of the forward propagation
+        step_lo = np.minimum(_floor(-out_max) + _floor(inflow), 
+                             _ceil(inflow - out_max - 1))
+        step_hi = np.maximum(_ceil(-out_min) + _ceil(inflow), 
+                             _floor(inflow - out_min) + 1)
+        
+        lo[step+1] = np.clip(lo[step] + step_lo, 0, num_states-1)
+        hi[step+1] = np.clip(hi[step] + step_hi, 0, num_states-1)
+        
+    return lo, hi
+
+
+def band_states(num_states, lo, hi):
+    """Sorted joint state indices of the box of basin states lo to hi 
+    (inclusive).
+    """
+    return StateSpace.get(num_states).box(lo, hi)
+
+
+def state_blocks(num_states_tot, n_blocks):
+    """Split the joint states into n_blocks contiguous blocks (slices)."""
+    bounds = np.linspace(0, num_states_tot, min(n_blocks, num_states_tot)+1)
+    bounds = np.int64(np.round(bounds))
+    return [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def interpolation_matrix(num_states_coarse, num_states_fine):
+    """Sparse (fine states x coarse states) matrix interpolating values on 
+    the grid of num_states_coarse states per basin multilinearly at the 
+    states of the grid of num_states_fine states per basin (both spanning 
+    the basin volumes).
+    """
+    
+    num_states_coarse = np.asarray(num_states_coarse)
+    num_states_fine = np.asarray(num_states_fine)
+    n_basins = len(num_states_fine)
+    
+    strides = StateSpace.get(num_states_coarse).strides
+    fine = StateSpace.get(num_states_fine)
+    
+    # lower coarse neighbour and weight of the upper one along each basin
+    lower = []
+    weights = []
+    for k in range(n_basins):
+        position = (np.multiply(fine.index(k), num_states_coarse[k]-1, dtype=np.int64)
+                    /(num_states_fine[k]-1))
+        lower_k = np.minimum(np.int64(position), num_states_coarse[k]-2)
+        lower.append(lower_k)
+        weights.append(position - lower_k)
+        
+    rows = np.arange(np.prod(num_states_fine))
+    data, i, j = [], [], []
+    for corner in np.ndindex(*(2, )*n_basins):
+        weight = np.ones(len(rows))
+        column = np.zeros(len(rows), dtype=np.int64)
+        for k, upper in enumerate(corner):
+            weight = weight*(weights[k] if upper else 1-weights[k])
+            column += strides[k]*(lower[k] + upper)
+        data.append(weight)
+        i.append(rows)
+        j.append(column)
+        
+    return sparse.coo_matrix(
+        (np.concatenate(data), (np.concatenate(i), np.concatenate(j))),
+        shape=(len(rows), np.prod(num_states_coarse))).tocsr()
+
+
+def band_blocks(states, n_blocks):
+    """Split the states of a band (a slice or an index array) into n_blocks 
+    blocks.
+    """
+    if isinstance(states, slice):
+        return [slice(states.start + block.start, states.start + block.stop)
+                for block in state_blocks(states.stop - states.start, n_blocks)]
+    return np.array_split(states, n_blocks)
+
+
+def map_blocks(func, blocks, executor=None):
+    """Call func for each block, in parallel if an executor is given."""
+    
+    if executor is None:
+        for block in blocks:
+            func(block)
+    else:
+        futures = [executor.submit(func, block) for block in blocks]
+        for future in futures:
+            future.result()
+
+
+POLICIES = ('dense', 'rle', 'checkpoint')
+
+
+def action_dtype(n_actions):
+    """Smallest unsigned integer type holding the indices of n_actions 
+    actions.
+    """
+    return np.min_scalar_type(max(n_actions-1, 0))
+
+
+class RunLengthPolicy():
+    """Action grid of shape (n_steps, states) (plus axes for price curves) 
+    stored as runs of equal actions along the states of each step. Optimal 
+    actions only change at few states, hence this takes much less memory than
+    the dense grid.
+    
+    Steps are set and read row by row (policy[step] = actions, policy[step], 
+    policy[step, state]). policy[..., k] selects price curve k and 
+    policy[start:stop] a range of steps, both without copying the runs.
+    """
+    
+    def __init__(self, n_steps, num_states_tot, batch_shape=(), dtype=np.int64):
+        self.shape = (n_steps, num_states_tot) + tuple(batch_shape)
+        self.dtype = np.dtype(dtype)
+        # starts and actions of the runs of each curve of each step
+        self._runs = [None]*n_steps
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    @property
+    def nbytes(self):
+        return sum(starts.nbytes + actions.nbytes 
+                   for runs in self._runs if runs is not None
+                   for starts, actions in runs)
+        
+    def __len__(self):
+        return self.shape[0]
+    
+    def __setitem__(self, step, actions):
+        actions = np.asarray(actions).reshape((self.shape[1], -1))
+        runs = []
+        for column in actions.T:
+            starts = np.flatnonzero(np.diff(column)) + 1
+            starts = np.concatenate(([0], starts)).astype(
+                np.min_scalar_type(self.shape[1]))
+            runs.append((starts, column[starts].astype(self.dtype)))
+        self._runs[step] = runs
+        
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index, )
+        
+        if index[0] is Ellipsis:
+            curves = np.arange(np.prod(self.shape[2:], dtype=np.int64)).reshape(self.shape[2:])
+            curves = curves[index[1:]]
+            policy = RunLengthPolicy(self.shape[0], self.shape[1], np.shape(curves), 
+                                     self.dtype)
+            policy._runs = [None if runs is None else [runs[k] for k in np.ravel(curves)]
+                            for runs in self._runs]
+            return policy
+        
+        step, index = index[0], index[1:]
+        
+        if isinstance(step, slice):
+            steps = range(*step.indices(self.shape[0]))
+            policy = RunLengthPolicy(len(steps), self.shape[1], self.shape[2:], 
+                                     self.dtype)
+            policy._runs = self._runs[step]
+            if index:
+                raise IndexError("Ranges of steps can not be indexed further.")
+            return policy
+        
+        runs = self._runs[step]
+        if len(index) > 0 and np.ndim(index[0]) == 0 and not isinstance(index[0], slice):
+            # single state, looked up in the runs
+            state, index = index[0], index[1:]
+            actions = np.array([actions[np.searchsorted(starts, state, side='right') - 1]
+                                for starts, actions in runs]).reshape(self.shape[2:])
+            return actions[index]
+        
+        lengths = (np.diff(np.append(starts, self.shape[1])) for starts, _ in runs)
+        actions = np.stack([np.repeat(actions, length) 
+                            for (_, actions), length in zip(runs, lengths)], axis=-1)
+        return actions.reshape(self.shape[1:])[index]
+    
+    @classmethod
+    def concatenate(cls, grids):
+        """Concatenate action grids (policies or dense arrays) along the steps."""
+        shape = tuple(grids[0].shape[1:])
+        policy = cls(0, shape[0], shape[1:], 
+                     np.result_type(*[grid.dtype for grid in grids]))
+        for grid in grids:
+            if isinstance(grid, cls):
+                policy._runs.extend(grid._runs)
+            else:
+                extension = cls(len(grid), shape[0], shape[1:], policy.dtype)
+                for step in range(len(grid)):
+                    extension[step] = grid[step]
+                policy._runs.extend(extension._runs)
+        policy.shape = (len(policy._runs), ) + shape
+        return policy
+
+
+class Checkpoints():
+    """Values of the states at every interval-th step of the backward 
+    induction, filled in like a value grid (see CheckpointPolicy).
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self._values = {}
+        
+    @property
+    def nbytes(self):
+        return sum(value.nbytes for value in self._values.values())
+        
+    def __setitem__(self, step, value):
+        if step % self.interval == 0:
+            self._values[step] = np.array(value)
+            
+    def __getitem__(self, step):
+        return self._values[step]
+
+
+class CheckpointPolicy():
+    """Action grid of shape (n_steps, states) (plus axes for price curves) 
+    that only keeps the values of the backward induction at every 
+    interval-th step (checkpoints). The actions of the steps between two 
+    checkpoints are recomputed with solve(start, stop, value_end) when one of
+    them is accessed, starting from the checkpoint at stop (value_end is None
+    for the last segment). The actions of the first segment, which are kept 
+    from the backward induction, and of the segment accessed last are stored.
+    
+    With the default interval of sqrt(n_steps) steps, the memory is 
+    O(sqrt(n_steps)) value vectors and a forward pass through all steps 
+    costs about one additional backward induction.
+    
+    Steps are read row by row (policy[step], policy[step, state]) and 
+    policy[..., k] selects price curve k.
+    """
+    
+    def __init__(self, n_steps, num_states_tot, batch_shape, solve, 
+                 interval=None, dtype=np.int64):
+        if interval is None:
+            interval = max(int(np.ceil(np.sqrt(n_steps))), 1)
+        
+        self.shape = (n_steps, num_states_tot) + tuple(batch_shape)
+        self.dtype = np.dtype(dtype)
+        self.interval = interval
+        self.checkpoints = Checkpoints(interval)
+        
+        self._solve = solve
+        self._index = ()
+        self._first = np.empty((min(interval, n_steps), ) + self.shape[1:], dtype=self.dtype)
+        # segment accessed last, shared by the selections of curves
+        self._segment = {'start': None, 'actions': None, 'recomputed': 0}
+        
+    @property
+    def ndim(self):
+        return len(self.shape)
+    
+    @property
+    def n_recomputed(self):
+        """Number of segments recomputed so far."""
+        return self._segment['recomputed']
+    
+    def __len__(self):
+        return self.shape[0]
+        
+    def __setitem__(self, step, actions):
+        # only the actions of the first segment are kept
+        if step < self.interval:
+            self._first[step] = actions
+            
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index, )
+            
+        if index[0] is Ellipsis:
+            policy = copy.copy(self)
+            policy._index = index
+            policy.shape = self.shape[:2] + np.empty(self.shape[2:])[index].shape
+            return policy
+        
+        step, index = index[0], index[1:]
+        start = step - step % self.interval
+        
+        if start == 0:
+            return self._first[step][self._index][index]
+        
+        segment = self._segment
+        if segment['start'] != start:
+            stop = min(start + self.interval, self.shape[0])
+            value_end = None if stop == self.shape[0] else self.checkpoints[stop]
+            segment['actions'] = self._solve(start, stop, value_end)
+            segment['start'] = start
+            segment['recomputed'] += 1
+            
+        return segment['actions'][step - start][self._index][index]
+
 
 def backward_induction(n_steps, volume, num_states, action_series,
-                       inflows, prices, water_value_end, penalty):
+                       inflows, prices, water_value_end, penalty,
+                       inflow_cache=None, operator='sparse', 
+                       executor=None, n_blocks=1, 
+                       build_executor=None, build_depth=2, value_end=None,
+                       value_dtype=np.float64, policy='dense', out=None, 
+                       band=None, seed=None):
+    """Compute the optimal action and the value of each state at each time 
+    step, starting at the end of the optimization.
+    
+    If an executor (e.g. a ThreadPoolExecutor) is given, the work of each 
+    step is split into blocks of actions or states that are evaluated in 
+    parallel. Each reward is computed exactly as in the serial case, hence 
+    the results are identical.
+    
+    If a build_executor is given, the transition operators of upcoming steps
+    are built ahead on its threads (see OperatorPipeline) while the current 
+    step is evaluated.
+    
+    If prices is an (n_steps x n_curves) array, all price curves are 
+    optimized at once. The value of the states is then an (states x curves)
+    matrix and the returned grids have an additional axis for the curves.
+    
+    If value_end is given, it is used as the value of the states after the 
+    last step instead of the water value (e.g. to continue the backward 
+    induction of a previous solution).
+    
+    The optimal actions are stored in the smallest unsigned integer type 
+    holding the action indices, as dense array (policy='dense') or as 
+    RunLengthPolicy (policy='rle'). The values are stored as value_dtype 
+    (e.g. np.float32), or not at all if value_dtype is None, in which case 
+    None is returned instead of the value grid.
+    
+    The computation is done in the precision of the operators of the core 
+    actions (see the dtype of CoreAction), e.g. in single precision for 
+    np.float32, which halves the memory traffic of each step.
+    
+    With policy='checkpoint', only the values of every sqrt(n_steps)-th step
+    are kept and a CheckpointPolicy is returned, which recomputes the actions 
+    between two checkpoints when they are accessed (without executors). No 
+    value grid is returned in this case.
+    
+    If out is given, the (action grid, value grid) of out are filled step by
+    step instead of allocating new grids, e.g. memory-mapped arrays to keep 
+    the grids of long horizons on disk. The value grid of out may be None.
+    
+    If band is given as the ranges (lo, hi) of the reachable states of each 
+    basin at each step (see reachable_band), the Bellman update of each step
+    is restricted to the states within the ranges. The actions of the other
+    states are set to zero and their values to seed(step) (the values of all
+    states at the step, e.g. interpolated from a coarse solution) if seed is 
+    given, otherwise to zero. Without seed, the ranges must contain the 
+    states reached by the transitions from within the ranges of the previous
+    step.
+    """
+    
+    if policy not in POLICIES:
+        raise ValueError("Unknown policy '{}', use one of {}.".format(policy, POLICIES))
+        
+    dtype = action_series[0][0].dtype
+    if penalty*n_steps > np.finfo(dtype).max:
+        raise ValueError("Penalty is too large for the precision {}.".format(dtype))
+    
+    if inflow_cache is None:
+        inflow_cache = OperatorCache()
+        
+    if operator == 'banded' and num_states.shape[0] != 1:
+        raise ValueError("Operator 'banded' is only available for power plants "
+                         "with a single basin.")
+        
+    # operators of each unique list of actions, built ahead of their use
+    if operator == 'stacked':
+        def build(actions):
+            return StackedActionSet(actions, n_blocks)
+    else:
+        def build(actions):
+            for action in actions:
+                action.build()
+            return actions
+        
+    if operator == 'banded':
+        # banded operators depend on the inflow and are cheap to compute
+        action_sets = None
+    else:
+        action_sets = OperatorPipeline(action_series, build, build_executor, 
+                                       build_depth)
 
-    num_states_tot = np.prod(num_states)
+    space = StateSpace.get(num_states)
+    num_states_tot = space.size
 
     # initialize boundary condition (valuation of states at the end of optimization)
     value = np.zeros((num_states_tot, ))
-    for k in np.arange(num_states.shape[0]):
-        value += water_value_end*volume[k]*np.linspace(0,1, num_states[k])[kron_index(num_states, k)]
+    for volume_k in space.volume_grid(volume):
+        value += water_value_end*volume_k
+
+    # price curves are evaluated together, i.e. the value becomes a matrix
+    batch_shape = np.shape(prices)[1:]
+    value = np.repeat(value[:, None], np.prod(batch_shape, dtype=np.int64), 
+                      axis=1).reshape((num_states_tot, ) + batch_shape)
+    
+    if value_end is not None:
+        value = np.array(value_end, dtype=np.float64).reshape(value.shape)
+    value = value.astype(dtype, copy=False)
+    # expand state quantities along the price curves
+    expand = (Ellipsis, ) + (None, )*len(batch_shape)
 
     # allocate momory
-    rewards_to_evaluate = np.zeros((len(action_series[0]), num_states_tot))
+    rewards_to_evaluate = np.zeros((max(len(actions) for actions in action_series), 
+                                    num_states_tot) + batch_shape,
+                                   dtype=dtype)
+    
+    state_slices = state_blocks(num_states_tot, n_blocks)
 
-    action_grid = []
-    value_grid = []
+    # allocate outputs, filled backwards
+    if out is not None:
+        action_grid, value_grid = out
+    else:
+        index_dtype = action_dtype(max(len(actions) for actions in action_series))
+        shape = (n_steps, num_states_tot) + batch_shape
+        if policy == 'rle':
+            action_grid = RunLengthPolicy(n_steps, num_states_tot, batch_shape, index_dtype)
+        elif policy == 'checkpoint':
+            def solve(start, stop, segment_value_end):
+                return backward_induction(
+                    stop - start, volume, num_states, action_series[start:stop], 
+                    inflows[start:stop], prices[start:stop], water_value_end, 
+                    penalty, inflow_cache, operator, 
+                    value_end=value_end if segment_value_end is None else segment_value_end,
+                    value_dtype=None,
+                    band=None if band is None else (band[0][start:stop], band[1][start:stop]),
+                    seed=None if seed is None else lambda step: seed(start + step))[0]
+            action_grid = CheckpointPolicy(n_steps, num_states_tot, batch_shape, 
+                                           solve, dtype=index_dtype)
+        else:
+            action_grid = np.empty(shape, dtype=index_dtype)
+            
+        if policy == 'checkpoint':
+            value_grid = action_grid.checkpoints
+        elif value_dtype is None:
+            value_grid = None
+        else:
+            value_grid = np.empty(shape, dtype=value_dtype)
     
     # loop backwards through time (backward induction)
     for backward_step_index in np.flip(np.arange(n_steps)):
-        price = prices[backward_step_index]
+        price = np.asarray(prices[backward_step_index], dtype=dtype)
         inflow = inflows[backward_step_index, :]
         actions = action_series[backward_step_index]
+        # the number of actions may differ between the steps
+        rewards = rewards_to_evaluate[:len(actions)]
         
-        # compute inflow transition matrix, which only changes with time
-        L_inflow = simple_trans_matrix(volume, num_states, -inflow)
+        # states of the Bellman update (all if states is None)
+        states = None
+        if band is not None:
+            lo, hi = band[0][backward_step_index], band[1][backward_step_index]
+            if np.any(lo > 0) or np.any(hi < num_states-1):
+                if operator == 'banded':
+                    states = slice(int(lo[0]), int(hi[0])+1)
+                else:
+                    states = band_states(num_states, lo, hi)
+        columns = slice(None) if states is None else states
+        step_blocks = state_slices if states is None else band_blocks(states, n_blocks)
         
-        for action_index, action in enumerate(actions):
+        if operator == 'banded':
+            
+            # get operators of all actions combined with the inflow, which are
+            # reused for identical inflows and actions (the operator keeps 
+            # a reference to actions, hence its id is not reused)
+            action_set = inflow_cache.get(
+                InflowOperator.key(volume, num_states, inflow, operator, dtype) + (id(actions), ),
+                lambda: BandedActionSet(actions, inflow))
+            
+            # evaluate all actions at once (for each block of states)
+            def evaluate(states):
+                rewards[:, states] = (
+                    action_set.propagate(value, states)
+                    + np.multiply.outer(action_set.power[:, states], price)
+                    - penalty*action_set.leakage[:, states][expand])
                 
-            L = L_inflow @ action.trans_matrix()
+            map_blocks(evaluate, step_blocks, executor)
             
-            immediate_reward = np.sum(action.turbine_action*price, axis=0)
-            future_reward = L.T.dot(value) 
+        else:
+            
+            # get inflow transition operator, which is reused for identical inflows
+            L_inflow = inflow_cache.get(
+                InflowOperator.key(volume, num_states, inflow, operator, dtype),
+                lambda: InflowOperator(volume, num_states, inflow, operator, dtype))
             
-            # TODO: Normalize penalty
-            penatly_reward = penalty*(1-np.sum(L, axis=0))
+            # (L_inflow @ L_action).T @ x == L_action.T @ (L_inflow.T @ x), hence
+            # the inflow is propagated once and shared by all actions
+            inflow_value = L_inflow.propagate(value)
             
-            rewards_to_evaluate[action_index, :] = future_reward + immediate_reward - penatly_reward
+            if operator == 'stacked':
+                
+                action_set = action_sets.get(actions)
+                leakage = L_inflow.leakage(action_set)
+                
+                # evaluate all actions with one sparse product (for each 
+                # block of actions)
+                def evaluate(block):
+                    rows, _ = block
+                    rewards[rows, columns] = (
+                        action_set.propagate(inflow_value, block, states) 
+                        + np.multiply.outer(action_set.power[rows, columns], price)
+                        - penalty*leakage[rows, columns][expand])
+                    
+                map_blocks(evaluate, action_set.blocks, executor)
+                
+            else:
+                
+                action_sets.get(actions)
+                
+                def evaluate(action_index):
+                    action = actions[action_index]
+                    
+                    immediate_reward = np.sum(np.multiply.outer(action.turbine_action[:, columns], price), axis=0)
+                    future_reward = action.propagate(inflow_value, states)
+                    
+                    # TODO: Normalize penalty
+                    penatly_reward = penalty*L_inflow.leakage(action)[columns][expand]
+                    
+                    rewards[action_index, columns] = future_reward + immediate_reward - penatly_reward
+                    
+                map_blocks(evaluate, range(len(actions)), executor)
 
-        # find index of optimal action for each state
-        optimal_action_index = np.argmax(rewards_to_evaluate, axis=0)
+        if states is None:
+            optimal_action_index = np.empty((num_states_tot, ) + batch_shape, dtype=np.int64)
+            next_value = np.empty((num_states_tot, ) + batch_shape, dtype=dtype)
+        else:
+            optimal_action_index = np.zeros((num_states_tot, ) + batch_shape, dtype=np.int64)
+            if seed is None:
+                next_value = np.zeros((num_states_tot, ) + batch_shape, dtype=dtype)
+            else:
+                seed_value = np.reshape(seed(backward_step_index), 
+                                        (num_states_tot, ) + batch_shape)
+                next_value = np.array(seed_value, dtype=dtype)
+        
+        def select(states):
+            # find index of optimal action for each state
+            optimal_action_index[states] = np.argmax(rewards[:, states], axis=0)
+            # value of each state is given by the reward of the optimal action
+            next_value[states] = np.take_along_axis(
+                rewards[:, states], optimal_action_index[None, states], axis=0)[0]
+            
+        map_blocks(select, step_blocks, executor)
         
-        # value of each state is given by the reward of the optimal action
-        value = rewards_to_evaluate[optimal_action_index, np.arange(num_states_tot)]
+            
+        value = next_value
                 
-        action_grid.append(optimal_action_index)
-        value_grid.append(value)
+        action_grid[backward_step_index] = optimal_action_index
+        if value_grid is not None:
+            value_grid[backward_step_index] = value
+            
+    if isinstance(value_grid, Checkpoints):
+        # the checkpoints are kept by the policy
+        value_grid = None
     
-    return np.flipud(np.array(action_grid)), np.flipud(np.array(value_grid))
+    return action_grid, value_grid
 
 
 def forward_propagation(n_steps, volume, num_states, basins_contents, action_series,
                         inflow, action_grid):
+    
+    # one dispatch per price curve of the grid, all curves are propagated step 
+    # by step, i.e. each step of the grid is read (or recomputed) only once
+    batch_shape = tuple(np.shape(action_grid)[2:])
+    
     # TODO: Clean up.
-    basin_actions_taken = np.zeros((n_steps, action_series[0][0].basin_action.shape[0]))
-    turbine_actions_taken = np.zeros((n_steps, action_series[0][0].turbine_action.shape[0]))
+    basin_actions_taken = np.zeros((n_steps, action_series[0][0].basin_action.shape[0]) 
+                                   + batch_shape)
+    turbine_actions_taken = np.zeros((n_steps, action_series[0][0].turbine_action.shape[0]) 
+                                     + batch_shape)
     
-    vol = np.zeros((n_steps+1, volume.shape[0]))
-    vol[0,:] = basins_contents
-    state_finder = kron_basis_map(num_states)
+    vol = np.zeros((n_steps+1, volume.shape[0]) + batch_shape)
+    vol[0] = np.reshape(basins_contents, (-1, ) + len(batch_shape)*(1, ))
+    space = StateSpace.get(num_states)
     
     for step_index, actions in enumerate(action_series):
         
         basin_actions = np.array([action.basin_action for action in actions])
         turbine_actions = np.array([action.turbine_action for action in actions])
         
-        state_index = np.dot(state_finder, np.int64(np.round((num_states-1)*vol[step_index, :]/volume)))
+        step_grid = action_grid[step_index]
         
-        try:
-            basin_actions_taken[step_index] = basin_actions[action_grid[step_index, state_index]][:,state_index]
-        except IndexError as e:
-            print(e)
+        for curve in np.ndindex(*batch_shape):
+            curve_index = (slice(None), ) + curve
+            state_index = space.ravel(np.int64(np.round(
+                (num_states-1)*vol[step_index][curve_index]/volume)))
+            action_index = step_grid[(state_index, ) + curve]
             
-        try:     
-            turbine_actions_taken[step_index] = turbine_actions[action_grid[step_index, state_index]][:,state_index]
-        except IndexError as e:
-            print(e)
+            try:
+                basin_actions_taken[step_index][curve_index] = basin_actions[action_index][:,state_index]
+            except IndexError as e:
+                print(e)
+                
+            try:     
+                turbine_actions_taken[step_index][curve_index] = turbine_actions[action_index][:,state_index]
+            except IndexError as e:
+                print(e)
             
-        vol[step_index+1, :] = vol[step_index,:] - basin_actions_taken[step_index, :] + inflow[step_index, :]
+        vol[step_index+1] = vol[step_index] - basin_actions_taken[step_index] \
+            + np.reshape(inflow[step_index], (-1, ) + len(batch_shape)*(1, ))
         
     return turbine_actions_taken, basin_actions_taken, vol
 
@@ -155,22 +1254,23 @@ def forward_propagation(n_steps, volume, num_states, basins_contents, action_ser
     
 def transition_coo_matrix_params(vol, num_states, q, basin_index):
  
+    space = StateSpace.get(num_states)
     # number of product states
-    m = np.prod(num_states)
+    m = space.size
     # range of product space indices
-    j = np.arange(m)
+    j = space.states()
     # volume defference between states for this basin
     dvols = vol/(num_states[basin_index]-1)
     # index step between different indices for this basin in kron matrix
-    basis_map = kron_basis_map(num_states)[basin_index]
+    basis_map = space.strides[basin_index]
     # state indices for this basin in kron space
-    index = kron_index(num_states, basin_index)
+    index = space.index(basin_index)
     # compute state indices change (interpolate -> floor/ceil)
     dk_floor = np.int64(q/dvols)
     dk_ceil = np.int64(dk_floor + np.sign(q))
     # compute target state indices (basin state index)
-    k_floor = index - dk_floor
-    k_ceil =  index - dk_ceil
+    k_floor = np.subtract(index, dk_floor, dtype=np.int64)
+    k_ceil =  np.subtract(index, dk_ceil, dtype=np.int64)
     # make sure new indices are not out of bound
     valid_floor = (k_floor < num_states[basin_index]) & (k_floor >= 0)
     valid_ceil = (k_ceil < num_states[basin_index]) & (k_ceil >= 0)
@@ -208,5 +1308,114 @@ def trans_matrix(vols, num_states, q):
     return L_combined
 
 
+def shift_axis(value, shift, axis):
+    """Shift value by an integer number of states along axis, i.e. 
+    out[..., n, ...] = value[..., n-shift, ...]. States that are shifted in 
+    from outside the basin limits are zero.
+    """
+    
+    out = np.zeros_like(value)
+    n = value.shape[axis]
+    
+    if abs(shift) < n:
+        target = [slice(None)]*value.ndim
+        source = [slice(None)]*value.ndim
+        
+        if shift >= 0:
+            target[axis] = slice(shift, None)
+            source[axis] = slice(0, n-shift)
+        else:
+            target[axis] = slice(0, n+shift)
+            source[axis] = slice(-shift, None)
+            
+        out[tuple(target)] = value[tuple(source)]
+        
+    return out
 
 
+class TensorTransition():
+    """Matrix-free version of trans_matrix(vols, num_states, q).
+    
+    Instead of materialising the m x m transition matrix, the value vector is 
+    reshaped to the tensor of basin states and the shift-and-interpolate step
+    of each basin is applied along its axis. Basins with a throughput that is 
+    constant across states are shifted by slicing, for the others only the 
+    per-state index shifts and interpolation weights are stored, i.e. the 
+    operator uses O(m) memory.
+    """
+    
+    def __init__(self, vols, num_states, q, dtype=np.float64):
+        self.shape = tuple(int(n) for n in num_states)
+        self.size = int(np.prod(self.shape))
+        
+        # (axis, dk_floor, sign, p_ceil) for each basin with throughput
+        self._axes = []
+        
+        for k in range(len(self.shape)):
+            dvols = vols[k]/(self.shape[k]-1)
+            
+            q_k = np.asarray(q[k], dtype=np.float64)
+            if np.all(q_k == q_k.flat[0]):
+                q_k = q_k.flat[0]
+            else:
+                q_k = q_k.reshape(self.shape)
+                
+            # compute state indices change (interpolate -> floor/ceil)
+            dk_floor = np.int64(q_k/dvols)
+            sign = np.int64(np.sign(q_k))
+            # compute weights
+            p_ceil = (np.abs(q_k) % dvols)/dvols
+            
+            if np.ndim(q_k) == 0:
+                if q_k != 0:
+                    self._axes.append((k, int(dk_floor), int(sign), float(p_ceil)))
+            else:
+                self._axes.append((k, dk_floor.astype(np.int32), 
+                                   sign.astype(np.int8), p_ceil.astype(dtype)))
+                
+    @property
+    def nbytes(self):
+        return sum(np.asarray(array).nbytes for axis in self._axes for array in axis[1:])
+    
+    def _apply_axis(self, value, axis, dk_floor, sign, p_ceil):
+        
+        if np.ndim(dk_floor) == 0:
+            return ((1-p_ceil)*shift_axis(value, dk_floor, axis) 
+                    + p_ceil*shift_axis(value, dk_floor+sign, axis))
+        
+        # additional axes of value (e.g. price curves) are broadcast
+        batch_axes = (None, )*(value.ndim-len(self.shape))
+        dk_floor = dk_floor[(Ellipsis, ) + batch_axes]
+        sign = sign[(Ellipsis, ) + batch_axes]
+        p_ceil = p_ceil[(Ellipsis, ) + batch_axes]
+        
+        n = self.shape[axis]
+        index_shape = [1]*value.ndim
+        index_shape[axis] = n
+        index = np.arange(n).reshape(index_shape)
+        
+        out = np.zeros_like(value)
+        for dk, p in ((dk_floor, 1-p_ceil), (dk_floor+sign, p_ceil)):
+            # compute target state indices (basin state index)
+            k_target = index - dk
+            # make sure new indices are not out of bound
+            valid = (k_target < n) & (k_target >= 0)
+            k_target = np.clip(k_target, 0, n-1)
+            out += np.where(valid, p, 0)*np.take_along_axis(value, k_target, axis)
+            
+        return out
+    
+    def propagate(self, value):
+        """Compute the product of the transposed transition matrix and 
+        value without forming the matrix. Additional axes of value (e.g. 
+        price curves) are kept.
+        """
+        
+        batch_shape = np.shape(value)[1:]
+        value = np.reshape(value, self.shape + batch_shape)
+        
+        # (L_0 @ L_1 @ ...).T @ v = ... @ L_1.T @ L_0.T @ v
+        for axis, dk_floor, sign, p_ceil in self._axes:
+            value = self._apply_axis(value, axis, dk_floor, sign, p_ceil)
+            
+        return value.reshape((self.size, ) + batch_shape)
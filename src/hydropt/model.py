@@ -1,7 +1,9 @@
+import itertools
+
 import numpy as np
 
-from hydropt.core import kron_index, kron_indices
-from hydropt.action import PowerPlantActions, PowerPlantAction
+from hydropt.core import StateSpace
+from hydropt.action import PowerPlantActions, PowerPlantAction, PowerAction
 
 
 class BasinLevels():
@@ -108,9 +110,8 @@ class Basin():
         if self.power_plant is None:
             return self._levels.empty
         else:
-            basin_num_states = self.power_plant.basin_num_states()
             index = self.power_plant.basin_index(self)
-            return self._levels.values[kron_index(basin_num_states, index)]
+            return self._levels.values[self.power_plant.state_space().index(index)]
         
     def __repr__(self):
         return f"Basin('{self.name}')"
@@ -165,6 +166,121 @@ class Turbine():
    
 
     
+def has_setpoints(action):
+    """Whether the turbine power and flow rates of the action are the ones 
+    of its setpoints (see PowerAction).
+    """
+    return (isinstance(action, PowerAction) 
+            and type(action).turbine_power is PowerAction.turbine_power
+            and type(action).flow_rates is PowerAction.flow_rates)
+
+
+class CompiledPowerPlant():
+    """Geometry of a power plant compiled into arrays over the joint basin 
+    states, from which the turbine powers and basin flow rates of all joint 
+    actions are computed at once (see PowerPlant.compiled).
+    
+    The head and the power per flow rate (efficiency*rho*g) are kept per 
+    turbine and state, the joint actions as (actions x turbines) indices 
+    into the actions of the turbines (the combinations of iter_actions).
+    """
+    
+    def __init__(self, power_plant, signature=None):
+        self.signature = signature
+        
+        basins = power_plant.basins
+        turbines = power_plant.turbines
+        
+        self.num_states = power_plant.basin_num_states()
+        self.state_space = power_plant.state_space()
+        self.size = self.state_space.size
+        
+        # levels of each basin of the plant at each joint state
+        levels = [basin._levels.values[self.state_space.index(k)] 
+                  for k, basin in enumerate(basins)]
+        
+        def basin_levels(basin):
+            index = power_plant.basin_index(basin)
+            return basin._levels.empty if index is None else levels[index]
+        
+        self.head = np.array([np.broadcast_to(basin_levels(turbine.upper_basin) 
+                                              - basin_levels(turbine.lower_basin), 
+                                              (self.size, ))
+                              for turbine in turbines]).reshape((len(turbines), self.size))
+        self.power_per_flow = np.array([turbine.efficiency*(1000*9.81) 
+                                        for turbine in turbines])
+        
+        # basins the turbines take water from and release it into (None 
+        # for basins outside of the plant, e.g. the outflow)
+        self.upper = [power_plant.basin_index(turbine.upper_basin) for turbine in turbines]
+        self.lower = [power_plant.basin_index(turbine.lower_basin) for turbine in turbines]
+        
+        self.turbine_actions = power_plant.turbine_actions()
+        self.combinations = np.array(
+            list(itertools.product(*[range(len(actions)) for actions in self.turbine_actions])),
+            dtype=np.intp).reshape((-1, len(turbines)))
+        
+        # actions that don't define their powers by setpoints (e.g. custom 
+        # actions or ones overriding turbine_power or flow_rates) are 
+        # evaluated one by one
+        self.fallback = [(t, k, action) for t, actions in enumerate(self.turbine_actions)
+                         for k, action in enumerate(actions) 
+                         if not has_setpoints(action)]
+        
+    def setpoints(self, constraints=None):
+        """Power and power of the flow rate of each action of each turbine
+        under the constraints as (turbines x actions) arrays (padded with 
+        zeros, as are the actions without setpoints).
+        """
+        n_actions = max((len(actions) for actions in self.turbine_actions), default=0)
+        power = np.zeros((len(self.turbine_actions), n_actions))
+        flow_power = np.zeros((len(self.turbine_actions), n_actions))
+        for t, actions in enumerate(self.turbine_actions):
+            for k, action in enumerate(actions):
+                if has_setpoints(action):
+                    power[t, k], flow_power[t, k] = action.setpoints(constraints)
+        return power, flow_power
+        
+    def action_arrays(self, constraints=None, combinations=None):
+        """Return the turbine powers (actions x turbines x states) and basin
+        flow rates (actions x basins x states) of the joint actions under the
+        constraints, either of all of them or of the given combinations.
+        """
+        
+        if combinations is None:
+            combinations = self.combinations
+            
+        power, flow_power = self.setpoints(constraints)
+        turbines = np.arange(len(self.turbine_actions))
+        
+        turbine_power = np.repeat(power[turbines, combinations][..., None], self.size, axis=-1)
+        
+        # flow rates of the turbines, (power/(efficiency*rho*g))/head as in 
+        # Turbine.flow_rate
+        flow = ((flow_power[turbines, combinations]/self.power_per_flow)[..., None]
+                / self.head)
+        
+        for t, k, action in self.fallback:
+            selected = combinations[:, t] == k
+            if np.any(selected):
+                turbine_power[selected, t] = action.turbine_power(constraints)
+                flow[selected, t] = action.flow_rates(constraints)
+        
+        basin_flow_rates = np.zeros((len(combinations), len(self.num_states), self.size))
+        for t in turbines:
+            if self.upper[t] is not None:
+                basin_flow_rates[:, self.upper[t]] += flow[:, t]
+            if self.lower[t] is not None:
+                basin_flow_rates[:, self.lower[t]] -= flow[:, t]
+                
+        return turbine_power, basin_flow_rates
+    
+    def action(self, power_plant, combination):
+        """Joint action of the given combination."""
+        return PowerPlantAction(power_plant, [actions[k] for actions, k 
+                                              in zip(self.turbine_actions, combination)])
+    
+
 class PowerPlant():
     def __init__(self, basins=None, turbines=None, constraints=None, name=''):
         self.basins = basins    
@@ -172,6 +288,8 @@ class PowerPlant():
         self.constraints = constraints
         self.name = name
         
+        self._compiled = None
+        
     @property
     def basins(self):
         return self._basins
@@ -203,20 +321,95 @@ class PowerPlant():
     def num_states(self):
         return np.prod(self.basin_num_states())
     
+    def state_space(self):
+        """Joint states of the basins (shared with the solver)."""
+        return StateSpace.get(self.basin_num_states())
+    
     def turbine_actions(self):
         return [turbine.actions for turbine in self.turbines]
         
+    def iter_actions(self):
+        """Iterate over the joint actions, i.e. the combinations of the 
+        actions of the turbines (the actions of the last turbine vary 
+        fastest), without building the list of all combinations.
+        """
+        for combination in itertools.product(*self.turbine_actions()):
+            yield PowerPlantAction(self, combination)
+        
     def actions(self):
-        turbine_actions = self.turbine_actions()
-        num_actions = [len(a) for a in turbine_actions]
-        combinations = kron_indices(num_actions, range(len(num_actions)))
-        power_plant_actions = PowerPlantActions()
-        for comb in combinations:
-            pp_action = PowerPlantAction(self)
-            for k in range(len(comb)):
-                pp_action.append(turbine_actions[k][comb[k]])
-            power_plant_actions.append(pp_action)
-        return power_plant_actions
+        return PowerPlantActions(self.iter_actions())
+    
+    def compiled(self):
+        """Return the plant compiled into arrays (see CompiledPowerPlant). It 
+        is rebuilt whenever the basins, turbines or their actions have been 
+        changed (or replaced) since.
+        """
+        
+        signature = self._signature()
+        compiled = getattr(self, '_compiled', None)
+        if compiled is None or compiled.signature != signature:
+            compiled = self._compiled = CompiledPowerPlant(self, signature)
+        return compiled
+    
+    def _signature(self):
+        """Attributes of the basins and turbines the compiled plant depends on."""
+        
+        def basin_signature(basin):
+            levels = basin._levels
+            return (id(basin), basin.volume, basin.num_states, id(levels), 
+                    levels.empty, levels.full, id(levels.vol_to_level_lut))
+        
+        return (tuple(basin_signature(basin) for basin in self.basins),
+                tuple((id(turbine), turbine.efficiency,
+                       basin_signature(turbine.upper_basin), 
+                       basin_signature(turbine.lower_basin),
+                       tuple(id(action) for action in turbine.actions))
+                      for turbine in self.turbines))
+    
+    def pruned_actions(self, constraints=None, dominated=False):
+        """Return the joint actions under the constraints without the ones
+        that are never needed by the optimization (see pruned_action_arrays).
+        """
+        
+        compiled = self.compiled()
+        combinations, _, _ = self.pruned_action_arrays(constraints, dominated)
+        return PowerPlantActions(compiled.action(self, combination) 
+                                 for combination in combinations)
+    
+    def pruned_action_arrays(self, constraints=None, dominated=False):
+        """Return the combinations (see CompiledPowerPlant), the turbine 
+        powers and the basin flow rates of the joint actions under the 
+        constraints without the ones that are never needed by the 
+        optimization. Actions with the same turbine powers and basin flows 
+        as an earlier action (e.g. MinPower and MaxPower clamped to the same 
+        power by the constraints) are dropped. If dominated is True, actions 
+        with the same basin flows as another action but no more total power 
+        are dropped as well, which is only valid for non-negative prices.
+        """
+        
+        compiled = self.compiled()
+        power, flows = compiled.action_arrays(constraints)
+        
+        # indices of the kept actions, grouped by basin flows
+        groups = {}
+        
+        if dominated:
+            total = power.sum(axis=1)
+            for index in range(len(power)):
+                group = groups.setdefault(flows[index].tobytes(), [])
+                if any(np.all(total[index] <= total[other]) for other in group):
+                    continue
+                group[:] = [other for other in group 
+                            if not np.all(total[other] <= total[index])]
+                group.append(index)
+        else:
+            for index in range(len(power)):
+                groups.setdefault((flows[index].tobytes(), power[index].tobytes()), [index])
+                    
+        # keep the order of the combinations
+        kept = np.sort(np.array([index for group in groups.values() for index in group], 
+                                dtype=np.intp))
+        return compiled.combinations[kept], power[kept], flows[kept]
     
     def summary(self):
         print("--------------------------------------------------")
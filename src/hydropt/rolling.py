@@ -0,0 +1,205 @@
+import numpy as np
+import time
+
+from hydropt.core import OperatorCache
+from hydropt.scenarios import Scenario, constraint_keys
+
+
+class RollingHorizon():
+    """Re-optimizes a power plant on a rolling horizon, e.g. every hour with
+    updated prices and inflow forecasts for a window that is shifted forward.
+
+    The core actions with their transition operators and the inflow operators
+    are kept between the runs. The solution of the previous run is aligned
+    by time with the new window and reused for all steps after the last step
+    whose inputs (constraints, prices, inflows or step lengths) changed. 
+    Steps beyond the end of the previous window always count as changed.
+
+    If a latency budget (in seconds) is given, the number of steps solved per
+    run is limited to what fits into the budget, estimated from the time per
+    step of the previous runs. Steps beyond the previous window and the first
+    steps of the window are solved, the steps in between keep the (stale)
+    solution of the previous run, which is also used as the value at the end
+    of the first steps. The number of reused steps whose solution is not
+    exact is kept in stale_steps_ of the scenario. The stale steps count as 
+    changed in the next run. Without a budget, the results are the same as 
+    for a full run.
+    
+    The scenarios are solved in the precision dtype (see Scenario).
+    
+    The inflow operators of updated inflow forecasts are rarely reused, hence
+    the least recently used ones are evicted once they take more than 
+    max_cache_bytes (see OperatorCache).
+    """
+
+    def __init__(self, power_plant, constraints=None, water_value_end=0,
+                 basin_limit_penalty=1e14*3600, latency_budget=None,
+                 operator=None, n_threads=None, n_build_threads=None,
+                 dtype=np.float64, max_cache_bytes=2**28):
+
+        self.power_plant = power_plant
+        self.constraints = constraints
+        self.water_value_end = water_value_end
+        self.basin_limit_penalty = basin_limit_penalty
+        self.latency_budget = latency_budget
+        self.operator = operator
+        self.n_threads = n_threads
+        self.n_build_threads = n_build_threads
+        self.dtype = np.dtype(dtype)
+
+        self.core_actions = {}
+        self.inflow_cache = OperatorCache(max_bytes=max_cache_bytes)
+
+        self.previous_ = None
+        self.stale_ = None
+        self.step_time_ = None
+
+    def update(self, underlyings, start_volumes=None, latency_budget=None):
+        """Optimize the window of underlyings and return the scenario. If
+        start_volumes are given, they are set as the start volumes of the
+        basins. The latency budget defaults to the one of the driver.
+        """
+
+        if start_volumes is not None:
+            for basin, start_volume in zip(self.power_plant.basins, start_volumes):
+                basin.start_volume = start_volume
+
+        if latency_budget is None:
+            latency_budget = self.latency_budget
+
+        scenario = Scenario(self.power_plant, underlyings, self.constraints,
+                            self.water_value_end, self.basin_limit_penalty,
+                            dtype=self.dtype)
+        operator = scenario.default_operator(self.operator)
+
+        t_start = time.time()
+
+        action_series = scenario.core_action_series(operator, self.core_actions)
+
+        n_steps = underlyings.n_steps()
+        shift, changed = self.changed_steps(scenario)
+
+        # previous solution aligned with the new window
+        if shift is None:
+            n_overlap = 0
+            action_grid = value_grid = None
+        else:
+            n_overlap = min(self.previous_.underlyings.n_steps() - shift, n_steps)
+            action_grid = _aligned(self.previous_.action_grid_, shift, n_steps)
+            value_grid = _aligned(self.previous_.value_grid_, shift, n_steps)
+
+        # steps [0, stop) are solved for exact results
+        stop = np.flatnonzero(changed)[-1] + 1 if np.any(changed) else 0
+
+        # steps of the window whose solution is not exact
+        stale = np.zeros(n_steps, dtype=bool)
+        
+        if (latency_budget is None or self.step_time_ is None or n_overlap == 0
+                or stop*self.step_time_ <= latency_budget):
+            segments = [(0, stop)]
+        else:
+            # steps without previous solution first, then as many steps at
+            # the start of the window as fit into the remaining budget
+            n_budget = int(latency_budget/self.step_time_)
+            n_front = max(1, min(stop, n_overlap, n_budget - (n_steps - n_overlap)))
+            segments = [(n_overlap, n_steps), (0, n_front)]
+            stale[n_front:min(stop, n_overlap)] = True
+
+        # solve the segments backwards in time, each starting from the value
+        # of the next one (or the previous solution)
+        steps_solved = 0
+        for start, segment_stop in segments:
+            if segment_stop <= start:
+                continue
+
+            value_end = None if segment_stop == n_steps else value_grid[segment_stop]
+            actions, values = scenario.solve(
+                action_series, start, segment_stop, value_end, operator,
+                self.n_threads, self.n_build_threads, self.inflow_cache)
+
+            if action_grid is None:
+                action_grid, value_grid = actions, values
+            else:
+                action_grid[start:segment_stop] = actions
+                value_grid[start:segment_stop] = values
+            steps_solved += segment_stop - start
+
+        t_solve = time.time() - t_start
+        if steps_solved > 0:
+            self.step_time_ = t_solve/steps_solved
+
+        scenario.propagate(action_series, action_grid)
+
+        scenario.action_grid_ = action_grid
+        scenario.value_grid_ = value_grid
+        scenario.inflow_cache_ = self.inflow_cache
+        scenario.core_actions_ = self.core_actions
+        scenario.steps_solved_ = steps_solved
+        scenario.stale_steps_ = int(np.sum(stale))
+        scenario.run_time_ = time.time() - t_start
+
+        self.previous_ = scenario
+        self.stale_ = stale
+
+        return scenario
+
+    def changed_steps(self, scenario):
+        """Align the window of the scenario with the previous run. Return the
+        index of the first step of the window in the previous window (or None
+        if the solution of the previous run can not be reused) and a boolean
+        array of the steps whose inputs differ from the previous run or whose
+        previous solution is stale.
+        """
+
+        n_steps = scenario.underlyings.n_steps()
+        changed = np.ones(n_steps, dtype=bool)
+
+        previous = self.previous_
+        if previous is None:
+            return None, changed
+
+        time_previous = previous.underlyings.time
+
+        shift = np.flatnonzero(time_previous == scenario.underlyings.time[0])
+        if (len(shift) == 0
+                or previous.water_value_end != scenario.water_value_end
+                or previous.basin_limit_penalty != scenario.basin_limit_penalty
+                or np.shape(previous.underlyings.price_curve)[1:]
+                    != np.shape(scenario.underlyings.price_curve)[1:]):
+            return None, changed
+
+        shift = shift[0]
+        n_overlap = min(len(time_previous) - shift, n_steps)
+
+        overlap = slice(0, n_overlap)
+        overlap_previous = slice(shift, shift+n_overlap)
+
+        changed[overlap] = [key != key_previous for key, key_previous in zip(
+            constraint_keys(scenario.power_plant, scenario.constraints_series)[overlap],
+            constraint_keys(previous.power_plant, previous.constraints_series)[overlap_previous])]
+
+        for series, series_previous in (
+                (scenario.underlyings.price_curve, previous.underlyings.price_curve),
+                (scenario.underlyings.inflow_rate, previous.underlyings.inflow_rate),
+                (scenario.underlyings.dt(), previous.underlyings.dt())):
+            series_changed = (np.asarray(series)[overlap]
+                              != np.asarray(series_previous)[overlap_previous])
+            changed[overlap] |= series_changed.reshape((n_overlap, -1)).any(axis=1)
+            
+        changed[overlap] |= self.stale_[overlap_previous]
+
+        # the value at the end of a shorter window differs
+        if shift + n_steps < len(time_previous):
+            changed[-1] = True
+
+        return shift, changed
+
+
+def _aligned(grid, shift, n_steps):
+    """Return a grid of n_steps steps starting with the steps of grid from
+    shift on. Steps beyond the end of grid are left uninitialized.
+    """
+    out = np.empty((n_steps, ) + np.shape(grid)[1:], dtype=grid.dtype)
+    n_overlap = min(len(grid) - shift, n_steps)
+    out[:n_overlap] = grid[shift:shift+n_overlap]
+    return out
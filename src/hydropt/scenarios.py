@@ -1,129 +1,719 @@
+import copy
 import numpy as np
+import os
 import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 
-from hydropt.core import backward_induction, forward_propagation, CoreAction
+from hydropt.core import backward_induction, forward_propagation, CoreAction, \
+    OperatorCache, RunLengthPolicy, CheckpointPolicy, action_dtype, \
+    reachable_band, interpolation_matrix
 from hydropt.constraints import ConstraintsSeries
 
 
 class Underlyings():
-    def __init__(self, time, price_curve=None, inflow_rate=None):
+    """Time series the optimization is based on. The price curve is either a 
+    single curve of shape (n_steps, ) or several curves of shape 
+    (n_steps, n_curves), which are optimized at once. The inflow rate has 
+    shape (n_steps, n_basins).
+    
+    The time steps start at the times in time and may have different 
+    lengths, e.g. hours for the first weeks and days thereafter. The last 
+    step ends at time_end, which defaults to the length of the step before.
+    Prices are per MWh, i.e. the reward of a step is weighted by its length
+    in hours.
+    """
+    
+    def __init__(self, time, price_curve=None, inflow_rate=None, time_end=None):
         self.time = time
         self.price_curve = price_curve
         self.inflow_rate = inflow_rate
         
+        if time_end is None:
+            time_end = time[-1] + (time[-1] - time[-2])
+        self.time_end = np.datetime64(time_end)
+        
     def n_steps(self):
         return self.time.shape[0]
     
     def dt(self):
-        return (self.time[1]-self.time[0]) / np.timedelta64(1, 's')
+        """Length of each time step in seconds."""
+        return np.diff(np.append(self.time, self.time_end)) / np.timedelta64(1, 's')
     
+    def n_curves(self):
+        if np.ndim(self.price_curve) > 1:
+            return np.shape(self.price_curve)[1]
+        return 1
     
-
-def compute_core_action_series(power_plant, constraints_series, dt):
-    unique_core_actions = {}
-    core_action_series = []
+    def inflow(self):
+        """Inflow volume of each time step and basin."""
+        return self.inflow_rate*self.dt()[:, None]
     
-    for contraints in constraints_series.normalized(power_plant.turbines):
+    def weighted_price_curve(self):
+        """Price curve weighted by the length of each time step in hours."""
+        return self.price_curve*_per_step(self.dt()/3600, self.price_curve)
+    
+    def aggregate(self, constraints=None, rtol=0, atol=0, max_dt=None):
+        """Return underlyings whose consecutive time steps with (nearly) the 
+        same prices and inflow rates are merged into single steps.
+        
+        A step is merged into the step before if its prices and inflow rates
+        are within rtol and atol (see np.isclose) of the first step of the 
+        merged step, no constraint starts or ends at its start and the merged
+        step does not get longer than max_dt seconds. Prices and inflow rates
+        of a merged step are the averages weighted by the lengths of the steps,
+        hence the inflow volume is kept. For example, a year of hourly steps 
+        with hourly forward prices for the first two weeks and daily (or 
+        weekly) ones thereafter is reduced to about 700 steps.
+        """
+        
+        dt = self.dt()
+        price = np.reshape(self.price_curve, (self.n_steps(), -1))
+        inflow_rate = np.reshape(self.inflow_rate, (self.n_steps(), -1))
+        
+        boundaries = np.array([time for constraint in constraints or [] 
+                               for time in (constraint.time_start, constraint.time_end)],
+                              dtype='datetime64')
         
-        key = tuple([tuple(constraint) for constraint in contraints.values()])
+        starts = [0]
+        for step in range(1, self.n_steps()):
+            first = starts[-1]
+            if (np.any(boundaries == self.time[step])
+                    or (max_dt is not None and dt[first:step+1].sum() > max_dt)
+                    or not np.allclose(price[step], price[first], rtol, atol)
+                    or not np.allclose(inflow_rate[step], inflow_rate[first], rtol, atol)):
+                starts.append(step)
+                
+        duration = np.add.reduceat(dt, starts)
+        
+        def merged(series):
+            return (np.add.reduceat(_per_step(dt, series)*series, starts, axis=0)
+                    / _per_step(duration, series))
+        
+        return Underlyings(self.time[starts], merged(self.price_curve), 
+                           merged(self.inflow_rate), self.time_end)
+    
+    
+def _per_step(x, series):
+    """Reshape x of shape (n_steps, ) to broadcast along the steps of series."""
+    return np.reshape(x, (-1, ) + (1, )*(np.ndim(series)-1))
+
+
+GRID_FILES = ('action_grid.npy', 'value_grid.npy')
+
+
+def load_grids(path):
+    """Load the action and value grids written by Scenario.run(grid_path=path)
+    as read-only memory maps, i.e. steps are only read from disk when they are 
+    accessed. The value grid is None if no values were stored.
+    """
+    
+    grids = []
+    for name in GRID_FILES:
+        file = os.path.join(path, name)
+        grids.append(np.load(file, mmap_mode='r') if os.path.exists(file) else None)
+    return tuple(grids)
+
+
+def _coarse_copy(scenario, num_states):
+    """Copy of the scenario on a copy of its power plant (and constraints of 
+    the turbines of the copy) with num_states states of the basins. The 
+    plant of the scenario is left as it is, e.g. for concurrent runs.
+    """
+    
+    power_plant = scenario.power_plant
+    
+    # the compiled plant of the original is not copied but rebuilt
+    memo = {id(getattr(power_plant, '_compiled', None)): None}
+    power_plant, constraints_series = copy.deepcopy(
+        (power_plant, scenario.constraints_series), memo)
+    for basin, n in zip(power_plant.basins, num_states):
+        basin.num_states = int(n)
         
-        if key not in unique_core_actions:
+    coarse = copy.copy(scenario)
+    coarse.power_plant = power_plant
+    coarse.constraints_series = constraints_series
+    return coarse
             
-            core_actions = []
-            for pp_action in power_plant.actions():
-                core_actions.append(
-                    CoreAction(
-                        np.array(pp_action.turbine_power(contraints)), 
-                        np.array(pp_action.basin_flow_rates(contraints))*dt, 
-                        power_plant.basin_volumes(), 
-                        power_plant.basin_num_states())
-                    )
             
-            unique_core_actions[key] = core_actions      
+def _state_index(vol, volume, num_states):
+    """(Fractional) state indices of the volumes vol of shape (steps, basins)
+    or (steps, basins, curves) as (steps, basins, curves) array.
+    """
+    vol = np.reshape(vol, np.shape(vol)[:2] + (-1, ))
+    return (np.asarray(num_states)-1)[:, None]*vol/np.asarray(volume)[:, None]
+
+
+def constraint_keys(power_plant, constraints_series):
+    """Return a hashable key of the constraints of each time step."""
+    keys = []
+    for start, stop, contraints in constraints_series.normalized_segments(power_plant.turbines):
+        keys += (stop - start)*[tuple([tuple(constraint) for constraint in contraints.values()])]
+    return keys
+
+
+def compute_core_action_series(power_plant, constraints_series, dt, 
+                               operator='sparse', unique_core_actions=None,
+                               dtype=np.float64, nonnegative_prices=False):
+    """Compute the core actions of each time step, whose lengths dt (in 
+    seconds) are either the same for all steps or given per step. Time steps
+    with the same constraints and length share the same list of core actions.
+    The lists are stored in unique_core_actions, which can be passed again to
+    share them (and their transition operators) between scenarios of the 
+    same power plant.
+    
+    Joint actions that are never optimal are dropped (see 
+    PowerPlant.pruned_actions), dominated ones only for the steps whose 
+    prices are nonnegative_prices (for all steps or given per step). Hence, 
+    the number of core actions may differ between the steps.
+    """
+    
+    if unique_core_actions is None:
+        unique_core_actions = {}
+        
+    core_action_series = []
+    
+    n_steps = len(constraints_series.time)
+    dt = np.broadcast_to(dt, n_steps)
+    nonnegative_prices = np.broadcast_to(nonnegative_prices, n_steps)
+    
+    # the constraints (and their key) are the same within each segment
+    for start, stop, contraints in constraints_series.normalized_segments(power_plant.turbines):
+        
+        constraints_key = tuple([tuple(constraint) for constraint in contraints.values()])
+        
+        for step in range(start, stop):
+            key = (constraints_key, float(dt[step]), bool(nonnegative_prices[step]), 
+                   operator, np.dtype(dtype).str)
             
-        core_action_series.append(unique_core_actions[key])
+            if key not in unique_core_actions:
+                
+                _, turbine_power, basin_flow_rates = power_plant.pruned_action_arrays(
+                    contraints, nonnegative_prices[step])
+                
+                core_actions = []
+                for power, flow_rates in zip(turbine_power, basin_flow_rates):
+                    core_actions.append(
+                        CoreAction(
+                            power, 
+                            flow_rates*dt[step], 
+                            power_plant.basin_volumes(), 
+                            power_plant.basin_num_states(),
+                            operator,
+                            dtype)
+                        )
+                
+                unique_core_actions[key] = core_actions      
+                
+            core_action_series.append(unique_core_actions[key])
         
     return core_action_series
     
         
 class Scenario():
+    """Optimization of the dispatch of a power plant for the given 
+    underlyings and constraints.
+    
+    With dtype=np.float32, the backward induction runs in single precision,
+    which halves the memory (traffic) of the operators, values and rewards. 
+    Leakage across the basin limits below the rounding level of single 
+    precision is ignored, as the basin limit penalty would amplify rounding 
+    errors otherwise. For the plant of the README example on the full year 
+    of each price curve of the shipped 2019 spot data, the valuation differs
+    by less than 2e-4 (relative) from double precision (see 
+    tests/test_precision.py).
+    """
+    
     def __init__(self, power_plant, underlyings, constraints=None, 
-                 water_value_end=0, basin_limit_penalty=1e14*3600, name=None):
+                 water_value_end=0, basin_limit_penalty=1e14*3600, name=None,
+                 dtype=np.float64):
         
         self.power_plant = power_plant
         self.underlyings = underlyings
         
         self.start_time = underlyings.time[0]
-        self.end_time = underlyings.time[-1] + (underlyings.time[1] - underlyings.time[0])
+        self.end_time = underlyings.time_end
         
-        if constraints is None:
-            self.constraints_series = ConstraintsSeries(self.start_time, self.end_time)
-        else:
-            self.constraints_series = ConstraintsSeries(self.start_time, 
-                                                        self.end_time,
-                                                        constraints)
+        self.constraints_series = ConstraintsSeries(self.start_time, 
+                                                    self.end_time,
+                                                    constraints,
+                                                    underlyings.time)
             
         self.water_value_end = water_value_end
         self.name = name
         
         self.basin_limit_penalty = basin_limit_penalty
         
+        self.dtype = np.dtype(dtype)
+        
 
-    def run(self):
-        n_steps = self.underlyings.n_steps()
-        dt = self.underlyings.dt()
-        price_curve = self.underlyings.price_curve
+    def run(self, operator=None, n_threads=None, n_build_threads=None, base=None,
+            core_actions=None, value_dtype='dtype', policy='dense', 
+            grid_path=None, reachability=False):
+        """Run the optimization.
         
-        inflow = self.underlyings.inflow_rate*dt
+        The transition operators are either sparse matrices (operator='sparse')
+        or matrix-free tensor operators (operator='tensor'). The latter only 
+        use O(m) memory for m joint basin states and should be used for
+        plants with large state spaces. With operator='stacked' the sparse 
+        matrices of all actions are stacked into one block operator, which 
+        evaluates all actions of a time step with a single sparse product at 
+        the cost of a second copy of the matrices. Plants with a single basin can use
+        banded operators (operator='banded'), which evaluate all actions of a
+        time step at once. By default, 'banded' is used for single-basin 
+        plants and 'sparse' otherwise.
         
-        volume = self.power_plant.basin_volumes()
-        num_states = self.power_plant.basin_num_states()
-        basins_init_volumes = self.power_plant.basin_start_volumes()
+        If n_threads is given, the work of each time step of the backward 
+        induction is split by actions or blocks of states and evaluated on a 
+        pool of n_threads threads. The results are identical to the serial 
+        computation.
+        
+        If n_build_threads is given, the transition operators of upcoming 
+        time steps are built ahead of time on a separate pool of 
+        n_build_threads threads while the current step is evaluated.
+        
+        If a base scenario that has been run before is given (e.g. the same 
+        power plant and underlyings without constraints), its solution is 
+        reused for all steps after the last step whose inputs differ (see 
+        last_changed_step). The backward induction then starts at this step.
+        The results are the same as for a full run. The values of the base 
+        must be kept in the precision of the scenario (value_dtype=dtype).
+        
+        The core actions (and their transition operators) of the run are kept 
+        in core_actions_. Passing them as core_actions to the run of another 
+        scenario of the same power plant shares them between both scenarios.
+        
+        The optimal actions are kept in action_grid_ in the smallest unsigned
+        integer type, either dense or, with policy='rle', run-length encoded 
+        along the states (see RunLengthPolicy). The values are kept in 
+        value_grid_ as value_dtype, which defaults to the precision of the 
+        scenario (value_dtype='dtype'). If value_dtype is None, no values are 
+        kept and the scenario can not be used as base.
         
-        penalty = self.basin_limit_penalty  
+        With policy='checkpoint', only the values at every sqrt(n_steps)-th
+        step are kept and the actions are recomputed from them when they are
+        needed (see CheckpointPolicy). This takes O(sqrt(n_steps)) memory at 
+        the cost of about one additional backward induction. Such scenarios
+        can neither use nor be used as base.
         
-        water_value_end = self.water_value_end
+        If reachability is True, the Bellman update of each step is 
+        restricted to the range of states of each basin that can be reached 
+        from the start volumes (see reachable_band), which is kept in band_.
+        The dispatch is the same, the actions and values of the other states
+        are zero. This saves work for short horizons, in which the volumes 
+        can only move a few states. Such scenarios can neither use nor be 
+        used as base.
+        
+        If grid_path (a directory) is given, the dense grids are written step
+        by step into memory-mapped .npy files in this directory, which are 
+        read back lazily (see load_grids). Only the pages in use are kept in 
+        memory, hence the memory does not grow with the length of the horizon.
+        """
+        
+        value_dtype = self.value_dtype(value_dtype)
+        
+        if grid_path is not None and policy != 'dense':
+            raise ValueError("Grids can only be memory-mapped with policy 'dense'.")
+            
+        if base is not None and policy == 'checkpoint':
+            raise ValueError("Policy 'checkpoint' can not be used with a base scenario.")
+            
+        if base is not None and (reachability or getattr(base, 'band_', None) is not None):
+            raise ValueError("Reachability can not be used with a base scenario.")
+            
+        if (base is not None and getattr(base, 'value_grid_', None) is not None
+                and base.value_grid_.dtype != self.dtype):
+            raise ValueError(f"Values of the base scenario are kept as "
+                             f"{base.value_grid_.dtype}, but the scenario is solved "
+                             f"as {self.dtype} (see value_dtype).")
+        
+        operator = self.default_operator(operator)
+        
+        n_steps = self.underlyings.n_steps()
+        
+        # geometry of the plant the solution is computed for
+        plant_signature = self.power_plant.compiled().signature
         
         t_start = time.time()
         
         # make core actions
-        action_series = compute_core_action_series(self.power_plant, self.constraints_series, dt)
+        if core_actions is None:
+            core_actions = {}
+        action_series = self.core_action_series(operator, core_actions)
+        
+        # inflow operators are reused for steps with identical inflow
+        inflow_cache = OperatorCache()
         
+        # steps after n_steps_solve are taken from the base scenario
+        if base is None:
+            n_steps_solve = n_steps
+        else:
+            n_steps_solve = self.last_changed_step(base) + 1
+            
+        if n_steps_solve < n_steps:
+            value_end = base.value_grid_[n_steps_solve]
+        else:
+            value_end = None
                 
-        action_grid, value_grid = backward_induction(
-            n_steps, 
-            volume, 
-            num_states, 
-            action_series, 
-            inflow, 
-            price_curve, 
-            water_value_end, 
-            penalty)
+        if reachability:
+            band = reachable_band(self.power_plant.basin_volumes(), 
+                                  self.power_plant.basin_num_states(),
+                                  self.power_plant.basin_start_volumes(), 
+                                  action_series, 
+                                  self.underlyings.inflow())
+        else:
+            band = None
+        
+        if grid_path is None:
+            out = None
+        else:
+            grids = self.open_grids(grid_path, action_series, value_dtype)
+            out = tuple(grid if grid is None else grid[:n_steps_solve] for grid in grids)
+                
+        if n_steps_solve > 0:
+            action_grid, value_grid = self.solve(action_series, 0, n_steps_solve, 
+                                                 value_end, operator, n_threads, 
+                                                 n_build_threads, inflow_cache,
+                                                 value_dtype, policy, out, band)
+        else:
+            # all inputs are the same as the ones of the base, i.e. all steps
+            # are taken from the base
+            action_grid = base.action_grid_[:0]
+            value_grid = None if value_dtype is None else \
+                np.empty((0, ) + base.value_grid_.shape[1:], dtype=value_dtype)
+                    
+        if grid_path is not None:
+            # copy the remaining steps of the base step by step
+            action_grid, value_grid = grids
+            for step in range(n_steps_solve, n_steps):
+                action_grid[step] = base.action_grid_[step]
+                if value_grid is not None:
+                    value_grid[step] = base.value_grid_[step]
+            for grid in grids:
+                if grid is not None:
+                    grid.flush()
+        elif n_steps_solve < n_steps:
+            action_grids = (action_grid, base.action_grid_[n_steps_solve:])
+            if policy == 'rle' or isinstance(base.action_grid_, RunLengthPolicy):
+                action_grid = RunLengthPolicy.concatenate(action_grids)
+            else:
+                action_grid = np.concatenate(action_grids)
+            if value_grid is not None:
+                value_grid = np.concatenate((value_grid, base.value_grid_[n_steps_solve:]))
         
         t_end = time.time()
         print(t_end-t_start)
         
         t_start = time.time()
+        self.propagate(action_series, action_grid)
+        t_end = time.time()
+        print(t_end-t_start)
+        
+        self.action_grid_ = action_grid
+        self.value_grid_ = value_grid
+        self.inflow_cache_ = inflow_cache
+        self.core_actions_ = core_actions
+        self.steps_solved_ = n_steps_solve
+        self.band_ = band
+        self.plant_signature_ = plant_signature
+        
+    def run_multigrid(self, coarse_num_states=41, margin=2, operator=None, 
+                      n_threads=None, n_build_threads=None, max_refinements=3):
+        """Run the optimization on a coarse grid first and refine around its
+        solution.
+        
+        The scenario is first solved with coarse_num_states states per basin.
+        The fine grid (the num_states of the basins) is then only solved in 
+        a band of margin coarse states around the coarse volumes of each 
+        step. The values of the states outside of the band are interpolated
+        from the coarse values. If the fine dispatch reaches the border of 
+        the band, the band is extended to the fine volumes, the margin is 
+        doubled and the fine grid solved again, at most max_refinements 
+        times before the full fine grid is solved.
+        
+        The result is an approximation: the fine dispatch is optimal within 
+        the band only. A wider margin or a finer coarse grid reduce the error.
+        
+        The coarse scenario is kept in coarse_ and the band of the fine grid 
+        in band_.
+        """
+        
+        operator = self.default_operator(operator)
+        
+        plant_signature = self.power_plant.compiled().signature
+        
+        volume = self.power_plant.basin_volumes()
+        num_states = self.power_plant.basin_num_states()
+        coarse_num_states = np.minimum(
+            np.broadcast_to(coarse_num_states, num_states.shape), num_states)
+        
+        # coarse solution
+        coarse = _coarse_copy(self, coarse_num_states)
+        coarse.run(operator, n_threads, n_build_threads)
+            
+        # values of the fine grid interpolated from the coarse values
+        interpolation = interpolation_matrix(coarse_num_states, num_states)
+        
+        def seed(step):
+            value = coarse.value_grid_[step]
+            return interpolation.dot(value.reshape((len(value), -1)))
+        
+        # range of the coarse volumes of each step (of all price curves) in 
+        # fine states
+        coarse_index = _state_index(coarse.volume_, volume, num_states)
+        index_min = coarse_index.min(axis=-1)
+        index_max = coarse_index.max(axis=-1)
+        
+        action_series = self.core_action_series(operator)
+        inflow_cache = OperatorCache()
+        
+        for refinement in range(max_refinements+1):
+            if refinement < max_refinements:
+                width = margin*2**refinement*(num_states-1)/(coarse_num_states-1)
+                lo = np.int64(np.clip(np.floor(index_min - width), 0, num_states-1))
+                hi = np.int64(np.clip(np.ceil(index_max + width), 0, num_states-1))
+                band = (lo, hi)
+            else:
+                band = None
+                
+            action_grid, value_grid = self.solve(
+                action_series, 0, None, None, operator, n_threads, 
+                n_build_threads, inflow_cache, band=band, seed=seed)
+            self.propagate(action_series, action_grid)
+            
+            if band is None:
+                break
+                
+            # the dispatch must stay off the border of the band (unless it is
+            # the border of the grid)
+            index = _state_index(self.volume_, volume, num_states)
+            rounded = np.round(index)
+            lo, hi = lo[..., None], hi[..., None]
+            if np.all(((rounded > lo) | (lo == 0)) 
+                      & ((rounded < hi) | (hi == num_states[:, None]-1))):
+                break
+            
+            # otherwise the band is extended to the fine volumes
+            index_min = np.minimum(index_min, index.min(axis=-1))
+            index_max = np.maximum(index_max, index.max(axis=-1))
+            
+        self.action_grid_ = action_grid
+        self.value_grid_ = value_grid
+        self.inflow_cache_ = inflow_cache
+        self.core_actions_ = None
+        self.steps_solved_ = self.underlyings.n_steps()
+        self.band_ = band
+        self.plant_signature_ = plant_signature
+        self.coarse_ = coarse
+        
+    def default_operator(self, operator=None):
+        """Return operator, or the default operator of the power plant if it is
+        None ('banded' for single-basin plants and 'sparse' otherwise).
+        """
+        if operator is None:
+            return 'banded' if len(self.power_plant.basins) == 1 else 'sparse'
+        return operator
+        
+    def core_action_series(self, operator='sparse', core_actions=None):
+        """Return the list of core actions of each time step."""
+        price = np.reshape(self.underlyings.price_curve, (self.underlyings.n_steps(), -1))
+        return compute_core_action_series(self.power_plant, self.constraints_series, 
+                                          self.underlyings.dt(), operator, 
+                                          core_actions, self.dtype,
+                                          np.all(price >= 0, axis=1))
+        
+    def solve(self, action_series, start=0, stop=None, value_end=None, 
+              operator='sparse', n_threads=None, n_build_threads=None, 
+              inflow_cache=None, value_dtype='dtype', policy='dense', 
+              out=None, band=None, seed=None):
+        """Run the backward induction for the time steps start to stop 
+        (excluded) and return the action and value grids of these steps. The 
+        value of the states at step stop is given by value_end. It defaults to 
+        the water value at the end and must be given if stop is not the last 
+        step. The grids are filled into out if it is given and the Bellman
+        update is restricted to the states of band (the ranges of all steps)
+        if it is given, using seed for the other states (see 
+        backward_induction).
+        """
+        
+        value_dtype = self.value_dtype(value_dtype)
+        
+        if stop is None:
+            stop = self.underlyings.n_steps()
+        
+        inflow = self.underlyings.inflow()
+        
+        if inflow_cache is None:
+            inflow_cache = OperatorCache()
+            
+        if n_threads is None:
+            executor = None
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_threads)
+            
+        if n_build_threads is None:
+            build_executor = None
+        else:
+            build_executor = ThreadPoolExecutor(max_workers=n_build_threads)
+        
+        try:
+            return backward_induction(
+                stop - start, 
+                self.power_plant.basin_volumes(), 
+                self.power_plant.basin_num_states(), 
+                action_series[start:stop], 
+                inflow[start:stop], 
+                self.underlyings.weighted_price_curve()[start:stop], 
+                self.water_value_end, 
+                self.basin_limit_penalty,
+                inflow_cache,
+                operator,
+                executor,
+                n_blocks=1 if n_threads is None else n_threads,
+                build_executor=build_executor,
+                build_depth=2*(n_build_threads or 1),
+                value_end=value_end,
+                value_dtype=value_dtype,
+                policy=policy,
+                out=out,
+                band=None if band is None else (band[0][start:stop], band[1][start:stop]),
+                seed=None if seed is None else lambda step: seed(start + step))
+        finally:
+            for pool in (executor, build_executor):
+                if pool is not None:
+                    pool.shutdown()
+                    
+    def value_dtype(self, value_dtype='dtype'):
+        """Return the dtype the values are kept as, i.e. the precision of the 
+        scenario for value_dtype='dtype'.
+        """
+        if isinstance(value_dtype, str) and value_dtype == 'dtype':
+            return self.dtype
+        return value_dtype
+        
+    def open_grids(self, path, action_series, value_dtype='dtype'):
+        """Create memory-mapped .npy files for the action and value grids in 
+        the directory path and return them. No value grid is created if 
+        value_dtype is None.
+        """
+        
+        value_dtype = self.value_dtype(value_dtype)
+        
+        os.makedirs(path, exist_ok=True)
+        
+        shape = ((self.underlyings.n_steps(), np.prod(self.power_plant.basin_num_states()))
+                 + np.shape(self.underlyings.price_curve)[1:])
+        
+        action_grid = np.lib.format.open_memmap(
+            os.path.join(path, GRID_FILES[0]), mode='w+', shape=shape,
+            dtype=action_dtype(max(len(actions) for actions in action_series)))
+        
+        if value_dtype is None:
+            value_grid = None
+            # remove the values of an earlier run
+            if os.path.exists(os.path.join(path, GRID_FILES[1])):
+                os.remove(os.path.join(path, GRID_FILES[1]))
+        else:
+            value_grid = np.lib.format.open_memmap(
+                os.path.join(path, GRID_FILES[1]), mode='w+', shape=shape, 
+                dtype=value_dtype)
+            
+        return action_grid, value_grid
+                    
+    def propagate(self, action_series, action_grid):
+        """Propagate the start volumes forward in time with the optimal actions
+        of action_grid and set the dispatch.
+        """
+        
+        inflow = self.underlyings.inflow()
+        
         turbine_act_taken, basin_act_taken, vol = forward_propagation(
-            n_steps, 
-            volume, 
-            num_states, 
-            basins_init_volumes,
+            self.underlyings.n_steps(), 
+            self.power_plant.basin_volumes(), 
+            self.power_plant.basin_num_states(), 
+            self.power_plant.basin_start_volumes(),
             action_series, 
             inflow, 
             action_grid)
         
-        t_end = time.time()
-        print(t_end-t_start)
+        self.set_dispatch(turbine_act_taken, basin_act_taken, vol)
         
-        self.action_grid_ = action_grid
-        self.value_grid_ = value_grid
+    def last_changed_step(self, base):
+        """Return the index of the last time step whose inputs (constraints, 
+        prices, inflows or length) differ from the ones of the base scenario, 
+        or -1 if all inputs are the same. The solutions of both scenarios are identical
+        for all later steps.
+        """
+        
+        n_steps = self.underlyings.n_steps()
+        
+        if (base.power_plant is not self.power_plant 
+                or base.underlyings.n_steps() != n_steps
+                or np.any(base.underlyings.time != self.underlyings.time)):
+            raise ValueError("Base scenario must have the same power plant and "
+                             "time steps.")
+            
+        if getattr(base, 'action_grid_', None) is None:
+            raise ValueError("Base scenario needs to be run first.")
+            
+        if isinstance(base.action_grid_, CheckpointPolicy):
+            raise ValueError("Base scenario was run with policy 'checkpoint' and "
+                             "keeps only the values of its checkpoints.")
+            
+        if getattr(base, 'band_', None) is not None:
+            raise ValueError("Base scenario was only solved in a band of states "
+                             "(reachability or run_multigrid).")
+            
+        if base.value_grid_ is None:
+            raise ValueError("Base scenario was run without keeping its values "
+                             "(value_dtype=None).")
+            
+        if getattr(base, 'plant_signature_', None) != self.power_plant.compiled().signature:
+            raise ValueError("Power plant has been changed since the base scenario "
+                             "was run.")
+            
+        if (base.water_value_end != self.water_value_end 
+                or base.basin_limit_penalty != self.basin_limit_penalty
+                or base.dtype != self.dtype
+                or np.shape(base.underlyings.price_curve) != np.shape(self.underlyings.price_curve)):
+            return n_steps-1
+        
+        changed = np.array([key != base_key for key, base_key in zip(
+            constraint_keys(self.power_plant, self.constraints_series),
+            constraint_keys(base.power_plant, base.constraints_series))])
+        
+        for series, base_series in ((self.underlyings.price_curve, base.underlyings.price_curve),
+                                    (self.underlyings.inflow_rate, base.underlyings.inflow_rate),
+                                    (self.underlyings.dt(), base.underlyings.dt())):
+            series_changed = np.asarray(series) != np.asarray(base_series)
+            changed |= series_changed.reshape((n_steps, -1)).any(axis=1)
+        
+        if np.any(changed):
+            return np.flatnonzero(changed)[-1]
+        return -1
+        
+    def set_dispatch(self, turbine_act_taken, basin_act_taken, vol):
+        """Set the dispatch (e.g. computed by another process) and the 
+        resulting frame of results.
+        """
         
         self.turbine_actions_ = turbine_act_taken
         self.basin_actions_ = basin_act_taken
         self.volume_ = vol
+
+        if np.ndim(self.underlyings.price_curve) > 1:
+            # one frame per price curve
+            self.results_ = pd.concat(
+                [self._results_frame(turbine_act_taken[..., k], vol[..., k],
+                                     self.underlyings.price_curve[:, k])
+                 for k in range(self.underlyings.n_curves())],
+                axis=1,
+                keys=range(self.underlyings.n_curves()))
+        else:
+            self.results_ = self._results_frame(turbine_act_taken, vol, 
+                                                self.underlyings.price_curve)
         
+    def _results_frame(self, turbine_act_taken, vol, price_curve):
 
         actions_taken = pd.DataFrame(
             index=self.underlyings.time,
@@ -139,18 +729,26 @@ class Scenario():
         
         price_curve_frame = pd.DataFrame(
             index=self.underlyings.time,
-            data=self.underlyings.price_curve,
+            data=price_curve,
             columns=['price curve (EUR/MWh)',]
         )
         
-        self.results_ = price_curve_frame.join(actions_taken).join(volumes_seen)
+        return price_curve_frame.join(actions_taken).join(volumes_seen)
         
         
     def valuation(self):
+        """Value of the dispatch. For several price curves, an array with the 
+        value of each curve is returned.
+        """
         if self.turbine_actions_ is None:
             RuntimeError('Need to run scenario first.')
             
-        return np.dot(self.turbine_actions_.T, self.underlyings.price_curve).sum()/1e6
+        price_curve = self.underlyings.weighted_price_curve()
+        
+        if np.ndim(price_curve) > 1:
+            return np.einsum('ntc,nc->c', self.turbine_actions_, price_curve)/1e6
+            
+        return np.dot(self.turbine_actions_.T, price_curve).sum()/1e6
         
         
 
@@ -0,0 +1,141 @@
+import numpy as np
+
+from hydropt import Basin, Outflow, Turbine, PowerPlant, \
+    Standing, MaxPower, Scenario, Underlyings
+from hydropt.action import BaseAction, FixedPowerAction
+from hydropt.constraints import TurbineConstraint
+from hydropt.scenarios import compute_core_action_series
+
+from test_backward_induction import make_power_plant
+
+
+def make_parallel_power_plant():
+    """Two turbines between the same basins, the second one with half the
+    efficiency, i.e. 20MW of the first and 10MW of the second turbine need
+    the same flow.
+    """
+    basin = Basin('basin', volume=81*3600, num_states=21, levels=(2000, 2120),
+                  start_volume=36000)
+    outflow = Outflow(outflow_level=600)
+
+    turbines = [
+        Turbine('turbine_1', max_power=20e6, base_load=10e6, efficiency=1.0,
+                upper_basin=basin, lower_basin=outflow,
+                actions=[Standing(), FixedPowerAction(20e6)]),
+        Turbine('turbine_2', max_power=10e6, base_load=5e6, efficiency=0.5,
+                upper_basin=basin, lower_basin=outflow,
+                actions=[Standing(), FixedPowerAction(10e6)]),
+    ]
+
+    return PowerPlant([basin], turbines)
+
+
+class TestPrunedActions():
+    def test_lazy_actions(self):
+        power_plant = make_power_plant(2)
+
+        assert [list(action) for action in power_plant.iter_actions()] \
+            == [list(action) for action in power_plant.actions()]
+        assert len(power_plant.actions()) == 9
+        assert len(power_plant.pruned_actions()) == 9
+
+    def test_duplicates(self):
+        power_plant = make_power_plant(2)
+        turbine = power_plant.turbines[0]
+
+        # MaxPower is clamped to the base load, i.e. the same as MinPower
+        constraints = {turbine: TurbineConstraint(turbine, '2020-04-01', '2020-04-02',
+                                                  power_max=turbine.base_load)}
+        actions = power_plant.pruned_actions(constraints)
+
+        assert len(actions) == 6
+        assert all(not isinstance(action[0], MaxPower) for action in actions)
+
+    def test_dominated(self):
+        power_plant = make_parallel_power_plant()
+
+        assert len(power_plant.pruned_actions()) == 4
+
+        # 10MW of the second turbine need the flow of 20MW of the first one
+        actions = power_plant.pruned_actions(dominated=True)
+        assert [[type(action) for action in pp_action] for pp_action in actions] \
+            == [[Standing, Standing], [FixedPowerAction, Standing], 
+                [FixedPowerAction, FixedPowerAction]]
+
+    def test_same_valuation(self):
+        power_plant = make_parallel_power_plant()
+
+        n_steps = 48
+        time = np.arange(np.datetime64('2020-04-01T00'),
+                         np.datetime64('2020-04-01T00') + n_steps)
+        price = 10*np.sin(2*np.pi*2*np.arange(n_steps)/n_steps) + 5
+        scenario = Scenario(power_plant, Underlyings(time, price, 0.8*np.ones((n_steps, 1))))
+        scenario.run()
+
+        # only steps with negative prices keep the dominated actions
+        action_series = scenario.core_action_series()
+        assert all(len(actions) == (3 if p >= 0 else 4) 
+                   for actions, p in zip(action_series, price))
+        assert np.any(price < 0)
+
+        # without dropping dominated actions
+        action_series = compute_core_action_series(
+            power_plant, scenario.constraints_series, scenario.underlyings.dt(),
+            'banded')
+        reference = Scenario(power_plant, scenario.underlyings)
+        action_grid, _ = reference.solve(action_series, operator='banded')
+        reference.propagate(action_series, action_grid)
+
+        assert np.isclose(scenario.valuation(), reference.valuation())
+        assert np.allclose(scenario.volume_, reference.volume_)
+
+
+class TestCompiledPowerPlant():
+    def test_same_as_actions(self):
+        power_plant = make_power_plant(2)
+        turbine = power_plant.turbines[1]
+        constraints = {turbine: TurbineConstraint(turbine, '2020-04-01', '2020-04-02',
+                                                  power_max=10e6)}
+
+        turbine_power, basin_flow_rates = power_plant.compiled().action_arrays(constraints)
+
+        actions = power_plant.actions()
+        assert np.array_equal(turbine_power, actions.turbine_power(constraints))
+        assert np.array_equal(basin_flow_rates, actions.basin_flow_rates(constraints))
+
+    def test_invalidated_on_mutation(self):
+        power_plant = make_power_plant(2)
+        compiled = power_plant.compiled()
+
+        assert power_plant.compiled() is compiled
+
+        power_plant.basins[1].num_states = 21
+        assert power_plant.compiled().head.shape == (2, 21*21)
+
+        power_plant.turbines[0].efficiency = 0.9
+        turbine_power, basin_flow_rates = power_plant.compiled().action_arrays()
+        assert np.array_equal(basin_flow_rates, power_plant.actions().basin_flow_rates())
+    
+    def test_actions_without_setpoints(self):
+        class HalfPower(BaseAction):
+            def turbine_power(self, constraints=None):
+                num_plant_states = self.turbine.upper_basin.power_plant.num_states()
+                return 0.5*self.turbine.max_power*np.ones((num_plant_states, ))
+            
+            def flow_rates(self, constraints=None):
+                return self.turbine.flow_rate(0.5*self.turbine.max_power)
+            
+        class BoostedMaxPower(MaxPower):
+            def turbine_power(self, constraints=None):
+                return 1.1*super().turbine_power(constraints)
+            
+        power_plant = make_power_plant(2)
+        turbines = power_plant.turbines
+        turbines[0].actions = turbines[0].actions + [HalfPower()]
+        turbines[1].actions = turbines[1].actions + [BoostedMaxPower()]
+        
+        turbine_power, basin_flow_rates = power_plant.compiled().action_arrays()
+        
+        actions = power_plant.actions()
+        assert np.allclose(turbine_power, actions.turbine_power())
+        assert np.allclose(basin_flow_rates, actions.basin_flow_rates())
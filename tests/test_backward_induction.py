@@ -0,0 +1,389 @@
+import copy
+
+import numpy as np
+import pytest
+
+from hydropt import Basin, Outflow, Turbine, PowerPlant, \
+    Standing, MinPower, MaxPower, Scenario, Underlyings
+from hydropt.constraints import TurbineConstraint
+from hydropt.scenarios import load_grids
+
+
+def make_power_plant(num_basins):
+    basins = [
+        Basin('basin_1', volume=81*3600, num_states=21, levels=(2000, 2120), 
+              start_volume=36000),
+        Basin('basin_2', volume=31*3600, num_states=11, levels=(1200, 1250), 
+              start_volume=36000),
+    ][:num_basins]
+    
+    outflow = Outflow(outflow_level=600)
+    
+    turbines = [
+        Turbine('turbine_1', max_power=33e6, base_load=10e6, efficiency=0.8,
+                upper_basin=basins[0], 
+                lower_basin=basins[1] if num_basins > 1 else outflow,
+                actions=[Standing(), MinPower(), MaxPower()]),
+        Turbine('turbine_2', max_power=15e6, base_load=7e6, efficiency=0.8,
+                upper_basin=basins[-1], lower_basin=outflow,
+                actions=[Standing(), MinPower(), MaxPower()]),
+    ]
+    
+    return PowerPlant(basins, turbines)
+
+
+def make_scenario(num_basins, n_steps=72):
+    power_plant = make_power_plant(num_basins)
+    
+    time = np.arange(np.datetime64('2020-04-01T00'), 
+                     np.datetime64('2020-04-01T00') + n_steps)
+    price = 10*(np.sin(2*np.pi*3*np.arange(n_steps)/n_steps) + 1)
+    inflow_rate = 0.8*np.ones((n_steps, num_basins))
+    
+    constraints = [
+        TurbineConstraint(power_plant.turbines[0], '2020-04-02T00', '2020-04-02T06', 
+                          power_max=0),
+    ]
+    
+    return Scenario(power_plant, Underlyings(time, price, inflow_rate), constraints)
+
+
+def assert_same_solution(scenario, reference):
+    # rounding errors are amplified by the basin limit penalty, hence actions 
+    # of states with (numerically) tied rewards may differ
+    assert np.allclose(scenario.value_grid_, reference.value_grid_, 
+                       rtol=1e-5, atol=1e4)
+    assert np.allclose(scenario.turbine_actions_, reference.turbine_actions_)
+    assert np.isclose(scenario.valuation(), reference.valuation())
+
+
+class TestOperators():
+    def test_stacked_operator(self):
+        reference = make_scenario(2)
+        reference.run(operator='sparse')
+        
+        scenario = make_scenario(2)
+        scenario.run(operator='stacked')
+        
+        assert_same_solution(scenario, reference)
+        
+    def test_tensor_operator(self):
+        reference = make_scenario(2)
+        reference.run(operator='sparse')
+        
+        scenario = make_scenario(2)
+        scenario.run(operator='tensor')
+        
+        assert_same_solution(scenario, reference)
+        
+    def test_banded_operator(self):
+        reference = make_scenario(1)
+        reference.run(operator='sparse')
+        
+        scenario = make_scenario(1)
+        scenario.run(operator='banded')
+        
+        assert_same_solution(scenario, reference)
+        
+        
+class TestThreads():
+    def test_identical_to_serial(self):
+        for num_basins, operator in [(2, 'sparse'), (2, 'stacked'), (1, 'banded')]:
+            reference = make_scenario(num_basins)
+            reference.run(operator=operator)
+            
+            scenario = make_scenario(num_basins)
+            scenario.run(operator=operator, n_threads=3)
+            
+            assert np.array_equal(scenario.value_grid_, reference.value_grid_)
+            assert np.array_equal(scenario.action_grid_, reference.action_grid_)
+        
+        
+class TestPriceCurves():
+    def test_batch_equals_single_curves(self):
+        for num_basins in [1, 2]:
+            scenario = make_scenario(num_basins)
+            underlyings = scenario.underlyings
+            prices = np.stack([underlyings.price_curve, 
+                               2*underlyings.price_curve[::-1]], axis=1)
+            
+            batch = Scenario(scenario.power_plant, 
+                             Underlyings(underlyings.time, prices, underlyings.inflow_rate))
+            batch.run()
+            
+            for k in range(prices.shape[1]):
+                single = Scenario(scenario.power_plant, 
+                                  Underlyings(underlyings.time, prices[:, k], 
+                                              underlyings.inflow_rate))
+                single.run()
+                
+                assert np.allclose(batch.value_grid_[..., k], single.value_grid_)
+                assert np.allclose(batch.turbine_actions_[..., k], single.turbine_actions_)
+                assert np.isclose(batch.valuation()[k], single.valuation())
+        
+        
+class TestIncremental():
+    def test_same_as_full_run(self):
+        for num_basins in [1, 2]:
+            scenario = make_scenario(num_basins)
+            base = Scenario(scenario.power_plant, scenario.underlyings)
+            base.run()
+            
+            scenario.run(base=base)
+            
+            reference = make_scenario(num_basins)
+            reference.run()
+            
+            # constraint ends on 2020-04-02T06 (step 29)
+            assert scenario.last_changed_step(base) == 29
+            assert np.array_equal(scenario.value_grid_, reference.value_grid_)
+            assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+            
+    def test_unchanged_inputs(self):
+        scenario = make_scenario(2, n_steps=24)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        base.run()
+        
+        for policy in ['dense', 'rle']:
+            unchanged = Scenario(scenario.power_plant, scenario.underlyings)
+            unchanged.run(base=base, policy=policy)
+            
+            assert unchanged.steps_solved_ == 0
+            assert np.array_equal(unchanged.value_grid_, base.value_grid_)
+            assert np.array_equal(unchanged.turbine_actions_, base.turbine_actions_)
+            
+    def test_changed_power_plant(self):
+        scenario = make_scenario(1, n_steps=24)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        base.run()
+        
+        scenario.power_plant.turbines[0].efficiency = 0.9
+        with pytest.raises(ValueError, match="changed"):
+            scenario.run(base=base)
+            
+    def test_base_of_other_precision(self):
+        scenario = make_scenario(1, n_steps=24)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        base.run(value_dtype=np.float32)
+        
+        with pytest.raises(ValueError):
+            scenario.run(base=base)
+            
+    def test_base_without_values(self):
+        scenario = make_scenario(1, n_steps=24)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        
+        with pytest.raises(ValueError, match="run first"):
+            scenario.last_changed_step(base)
+        
+        for run_kwargs, message in [({'value_dtype': None}, "value_dtype=None"),
+                                    ({'policy': 'checkpoint'}, "policy 'checkpoint'")]:
+            base.run(**run_kwargs)
+            with pytest.raises(ValueError, match=message):
+                scenario.last_changed_step(base)
+                
+        base.run_multigrid(coarse_num_states=11)
+        with pytest.raises(ValueError, match="run_multigrid"):
+            scenario.last_changed_step(base)
+            
+            
+class TestStorage():
+    def test_compact_grids(self):
+        reference = make_scenario(2)
+        reference.run()
+        
+        scenario = make_scenario(2)
+        scenario.run(value_dtype=np.float32)
+        
+        assert reference.action_grid_.dtype == np.uint8
+        assert scenario.value_grid_.dtype == np.float32
+        assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+        
+        scenario = make_scenario(2)
+        scenario.run(value_dtype=None)
+        
+        assert scenario.value_grid_ is None
+        assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+        
+    def test_run_length_policy(self):
+        for num_basins in [1, 2]:
+            reference = make_scenario(num_basins)
+            reference.run()
+            
+            scenario = make_scenario(num_basins)
+            scenario.run(policy='rle')
+            
+            policy = scenario.action_grid_
+            assert policy.nbytes < reference.action_grid_.nbytes
+            assert all(np.array_equal(policy[step], reference.action_grid_[step])
+                       for step in range(len(policy)))
+            assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+            
+            # incremental run on top of the encoded solution
+            underlyings = scenario.underlyings
+            price = underlyings.price_curve.copy()
+            price[:40] *= 1.5
+            incremental = copy.copy(scenario)
+            incremental.underlyings = Underlyings(underlyings.time, price, 
+                                                  underlyings.inflow_rate)
+            incremental.run(base=scenario, policy='rle')
+            
+            full = copy.copy(incremental)
+            full.run()
+            
+            assert np.array_equal(incremental.turbine_actions_, full.turbine_actions_)
+            
+    def test_checkpoint_policy(self):
+        for num_basins in [1, 2]:
+            reference = make_scenario(num_basins)
+            reference.run()
+            
+            scenario = make_scenario(num_basins)
+            scenario.run(policy='checkpoint')
+            
+            policy = scenario.action_grid_
+            
+            # 72 steps in 8 segments, all but the first are recomputed once
+            assert policy.interval == 9
+            assert policy.n_recomputed == 7
+            assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+            assert all(np.array_equal(policy[step], reference.action_grid_[step])
+                       for step in range(len(policy)))
+
+    def test_checkpoint_policy_price_curves(self):
+        scenario = make_scenario(2)
+        underlyings = scenario.underlyings
+        prices = np.stack([underlyings.price_curve, 2*underlyings.price_curve[::-1],
+                           underlyings.price_curve + 5], axis=1)
+        underlyings = Underlyings(underlyings.time, prices, underlyings.inflow_rate)
+        
+        reference = Scenario(scenario.power_plant, underlyings)
+        reference.run()
+        
+        batch = Scenario(scenario.power_plant, underlyings)
+        batch.run(policy='checkpoint')
+        
+        # the segments are recomputed once for all curves
+        assert batch.action_grid_.n_recomputed == 7
+        assert np.array_equal(batch.turbine_actions_, reference.turbine_actions_)
+        assert np.array_equal(batch.volume_, reference.volume_)
+            
+    def test_memory_mapped_grids(self, tmp_path):
+        reference = make_scenario(2)
+        reference.run()
+        
+        scenario = make_scenario(2)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        base.run(grid_path=tmp_path / 'base')
+        
+        # incremental run on top of the mapped solution of the base
+        scenario.run(base=base, grid_path=tmp_path / 'scenario')
+        
+        action_grid, value_grid = load_grids(tmp_path / 'scenario')
+        
+        assert isinstance(action_grid, np.memmap)
+        assert np.array_equal(action_grid, reference.action_grid_)
+        assert np.array_equal(value_grid, reference.value_grid_)
+        assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+            
+            
+class TestReachability():
+    def test_same_dispatch(self):
+        for num_basins, operators in [(1, ['banded', 'sparse']), 
+                                      (2, ['sparse', 'stacked', 'tensor'])]:
+            for operator in operators:
+                reference = make_scenario(num_basins, n_steps=24)
+                reference.run(operator=operator)
+                
+                scenario = make_scenario(num_basins, n_steps=24)
+                scenario.run(operator=operator, reachability=True)
+                
+                lo, hi = scenario.band_
+                num_states = scenario.power_plant.basin_num_states()
+                volume = scenario.power_plant.basin_volumes()
+                index = np.round((num_states-1)*scenario.volume_/volume)
+                
+                assert np.all(hi[0] == lo[0]) and np.any(hi[1] - lo[1] < num_states-1)
+                assert np.all((lo <= index) & (index <= hi))
+                assert np.array_equal(scenario.turbine_actions_, reference.turbine_actions_)
+                
+    def test_no_base(self):
+        scenario = make_scenario(1, n_steps=24)
+        base = Scenario(scenario.power_plant, scenario.underlyings)
+        base.run()
+        
+        with pytest.raises(ValueError):
+            scenario.run(base=base, reachability=True)
+
+
+class TestMultigrid():
+    def test_close_to_full_grid(self):
+        for num_basins in [1, 2]:
+            reference = make_scenario(num_basins, n_steps=24)
+            reference.run()
+            
+            scenario = make_scenario(num_basins, n_steps=24)
+            scenario.run_multigrid(coarse_num_states=11)
+            
+            assert scenario.coarse_.value_grid_.shape[1] < reference.value_grid_.shape[1]
+            assert np.isclose(scenario.valuation(), reference.valuation(), rtol=1e-2)
+            
+    def test_power_plant_unchanged(self):
+        scenario = make_scenario(2, n_steps=24)
+        power_plant = scenario.power_plant
+        compiled = power_plant.compiled()
+        
+        scenario.run_multigrid(coarse_num_states=11)
+        coarse = scenario.coarse_
+        
+        # the coarse grid is solved on a copy of the plant and its constraints
+        assert coarse.power_plant is not power_plant
+        assert list(coarse.power_plant.basin_num_states()) == [11, 11]
+        assert power_plant.compiled() is compiled
+        assert all(turbine in coarse.power_plant.turbines 
+                   for _, _, constraints in coarse.constraints_series.segments()
+                   for turbine in constraints)
+
+
+class TestTimeSteps():
+    def test_step_lengths(self):
+        scenario = make_scenario(2, n_steps=24)
+        underlyings = scenario.underlyings
+        
+        # hourly steps first, four-hourly steps thereafter
+        time = np.concatenate((underlyings.time[:12], underlyings.time[12::4]))
+        underlyings = Underlyings(time, underlyings.price_curve[:len(time)], 
+                                  underlyings.inflow_rate[:len(time)], 
+                                  time_end=underlyings.time[-1] + 1)
+        scenario = Scenario(scenario.power_plant, underlyings)
+        scenario.run()
+        
+        dt = underlyings.dt()
+        assert np.array_equal(dt/3600, [1]*12 + [4]*3)
+        assert np.allclose(np.diff(scenario.volume_, axis=0), 
+                           dt[:, None]*underlyings.inflow_rate - scenario.basin_actions_)
+        assert np.isclose(scenario.valuation(), 
+                          np.sum(scenario.turbine_actions_.sum(axis=1)
+                                 *underlyings.price_curve*dt/3600)/1e6)
+        
+    def test_aggregate(self):
+        scenario = make_scenario(2)
+        underlyings = scenario.underlyings
+        constraint = scenario.constraints_series[24][scenario.power_plant.turbines[0]]
+        
+        # daily prices after the first day
+        price = underlyings.price_curve.copy()
+        price[24:] = np.repeat(price[24:].reshape((-1, 24)).mean(axis=1), 24)
+        underlyings = Underlyings(underlyings.time, price, underlyings.inflow_rate)
+        
+        aggregated = underlyings.aggregate([constraint])
+        
+        # the second day is split at the end of the constraint
+        assert np.array_equal(aggregated.dt()/3600, [1]*24 + [6, 18, 24])
+        assert aggregated.time_end == underlyings.time_end
+        assert np.allclose(aggregated.inflow().sum(axis=0), underlyings.inflow().sum(axis=0))
+        assert np.allclose(aggregated.weighted_price_curve().sum(), 
+                           underlyings.weighted_price_curve().sum())
+        
+        aggregated = underlyings.aggregate([constraint], max_dt=12*3600)
+        assert np.array_equal(aggregated.dt()/3600, [1]*24 + [6, 12, 6, 12, 12])
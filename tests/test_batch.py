@@ -0,0 +1,110 @@
+import pickle
+
+import numpy as np
+
+from hydropt import Scenario, ScenarioBatch, ConstraintSweep
+from hydropt.batch import SharedArray
+from hydropt.constraints import TurbineConstraint
+
+from test_backward_induction import make_scenario
+
+
+class TestSharedArray():
+    def test_roundtrip(self):
+        array = np.arange(12, dtype=np.float64).reshape((3, 4))
+        shared = SharedArray(array)
+        
+        try:
+            attached = pickle.loads(pickle.dumps(shared))
+            assert np.array_equal(attached.array(), array)
+        finally:
+            shared.release()
+        
+
+class TestScenarioBatch():
+    def test_same_as_serial(self):
+        scenarios = [make_scenario(1), make_scenario(2)]
+        # scenario without constraints sharing the underlyings of the first
+        scenarios.append(Scenario(scenarios[0].power_plant, scenarios[0].underlyings))
+        
+        batch = ScenarioBatch(scenarios, n_workers=2, progress=None)
+        batch.run()
+        
+        table = batch.valuation(base=2)
+        
+        for k, reference in enumerate([make_scenario(1), make_scenario(2)]):
+            reference.run()
+            
+            assert np.allclose(scenarios[k].turbine_actions_, reference.turbine_actions_)
+            assert np.isclose(table['valuation'].iloc[k], reference.valuation())
+            
+        assert table['opportunity cost'].iloc[2] == 0
+        
+        
+class TestConstraintSweep():
+    def test_same_as_full_runs(self):
+        scenario = make_scenario(2)
+        power_plant, underlyings = scenario.power_plant, scenario.underlyings
+        turbine = power_plant.turbines[1]
+        
+        constraint_sets = [
+            [TurbineConstraint(turbine, underlyings.time[k], underlyings.time[k+6],
+                               name=f'block {k}', power_max=0)]
+            for k in range(0, 24, 6)]
+        
+        base = Scenario(power_plant, underlyings)
+        base.run()
+        core_actions = dict(base.core_actions_)
+        
+        sweep = ConstraintSweep(base, constraint_sets, n_workers=2, progress=None)
+        sweep.run()
+        table = sweep.opportunity_costs()
+        
+        assert list(table.index) == ['block 0', 'block 6', 'block 12', 'block 18']
+        assert list(table['steps solved']) == [6, 12, 18, 24]
+        
+        # the variants do not add their action lists to the base
+        assert base.core_actions_ == core_actions
+        
+        for k, constraints in enumerate(constraint_sets):
+            reference = Scenario(power_plant, underlyings, constraints)
+            reference.run()
+            
+            assert np.isclose(table['opportunity cost'].iloc[k], 
+                              base.valuation() - reference.valuation())
+            
+    def test_unchanged_variants(self):
+        scenario = make_scenario(2, n_steps=24)
+        power_plant, underlyings = scenario.power_plant, scenario.underlyings
+        turbine = power_plant.turbines[1]
+        
+        # a slot outside of the horizon and an empty set change no step
+        constraint_sets = [
+            [TurbineConstraint(turbine, '2020-05-01T00', '2020-05-01T06', power_max=0)], 
+            []]
+        
+        base = Scenario(power_plant, underlyings)
+        sweep = ConstraintSweep(base, constraint_sets, progress=None)
+        sweep.run()
+        table = sweep.opportunity_costs()
+        
+        assert list(table['steps solved']) == [0, 0]
+        assert list(table['opportunity cost']) == [0, 0]
+        
+    def test_single_precision_base(self):
+        scenario = make_scenario(2)
+        power_plant, underlyings = scenario.power_plant, scenario.underlyings
+        turbine = power_plant.turbines[1]
+        
+        constraint_sets = [
+            [TurbineConstraint(turbine, underlyings.time[k], underlyings.time[k+6],
+                               power_max=0)]
+            for k in range(0, 18, 6)]
+        
+        base = Scenario(power_plant, underlyings, dtype=np.float32)
+        sweep = ConstraintSweep(base, constraint_sets, progress=None)
+        sweep.run()
+        
+        # the values are kept in the precision of the base
+        assert base.value_grid_.dtype == np.float32
+        assert list(sweep.opportunity_costs()['steps solved']) == [6, 12, 18]
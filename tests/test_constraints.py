@@ -0,0 +1,65 @@
+import numpy as np
+
+from hydropt.constraints import ConstraintsSeries, TurbineConstraint
+
+from test_backward_induction import make_power_plant
+
+
+class TestConstraintsSeries():
+    def test_segments(self):
+        turbines = make_power_plant(2).turbines
+        time_start = np.datetime64('2020-04-01T00')
+
+        constraints = [
+            TurbineConstraint(turbines[0], '2020-04-01T02', '2020-04-01T08', power_max=20e6),
+            TurbineConstraint(turbines[0], '2020-04-01T04', '2020-04-01T06', power_max=15e6),
+            TurbineConstraint(turbines[1], '2020-04-01T08', '2020-04-01T10', power_max=10e6),
+            # same constraints as the one before, i.e. in the same segment
+            TurbineConstraint(turbines[1], '2020-04-01T10', '2020-04-01T12', power_max=10e6),
+            TurbineConstraint(turbines[1], '2020-03-31T00', '2020-03-31T12', power_max=0),
+        ]
+        series = ConstraintsSeries(time_start, time_start + 24, constraints)
+
+        assert [(start, stop) for start, stop, _ in series.segments()] \
+            == [(0, 2), (2, 4), (4, 6), (6, 8), (8, 12), (12, 24)]
+        assert series[5][turbines[0]].upper_bound() == 15e6
+        assert series[7][turbines[0]].upper_bound() == 20e6
+        assert series[9] is series[11]
+
+        # the same constraints as adding them at each step
+        for step, time in enumerate(series.time):
+            expected = {}
+            for constraint in constraints:
+                if constraint.time_start <= time < constraint.time_end:
+                    if constraint.turbine in expected:
+                        expected[constraint.turbine] += constraint
+                    else:
+                        expected[constraint.turbine] = constraint
+            assert series[step] == expected
+
+    def test_normalized(self):
+        turbines = make_power_plant(2).turbines
+        time_start = np.datetime64('2020-04-01T00')
+
+        constraint = TurbineConstraint(turbines[0], '2020-04-01T02', '2020-04-01T08',
+                                       power_max=0)
+        normalized = ConstraintsSeries(time_start, time_start + 24,
+                                       [constraint]).normalized(turbines)
+
+        assert len(normalized) == 24
+        assert normalized[0] is normalized[1] and normalized[2] is normalized[7]
+        assert normalized[2][turbines[0]] is constraint
+        assert normalized[2][turbines[1]] is normalized[0][turbines[1]]
+        assert normalized[0][turbines[0]].upper_bound() == turbines[0].max_power
+
+    def test_cached_steps(self):
+        turbines = make_power_plant(2).turbines
+        time_start = np.datetime64('2020-04-01T00')
+
+        constraint = TurbineConstraint(turbines[0], '2020-04-01T02', '2020-04-01T08',
+                                       power_max=0)
+        series = ConstraintsSeries(time_start, time_start + 24, [constraint])
+
+        assert series.data is series.data
+        assert list(series) == series.data
+        assert series[5] is series.data[5]
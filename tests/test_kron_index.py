@@ -1,5 +1,5 @@
 import numpy as np
-from hydropt.core import kron_index
+from hydropt.core import kron_index, kron_basis_map, StateSpace
 
 def kron_index_ref(num_states, position):
     index = np.ones(1, dtype=np.int64)
@@ -23,6 +23,30 @@ class TestKronIndex():
         num_states = [2,3,4]
         position = 1
         assert np.all(kron_index(num_states, position) == kron_index_ref(num_states, position))
+
+    
+class TestStateSpace():
+    def test_index(self):
+        space = StateSpace([2, 3, 300])
+        
+        for position in range(3):
+            assert np.all(space.index(position) == kron_index_ref([2, 3, 300], position))
+        assert space.index(1).dtype == np.uint16 and not space.index(1).flags.writeable
+        assert np.array_equal(space.strides, kron_basis_map([2, 3, 300]))
+        
+    def test_ravel_unravel(self):
+        space = StateSpace([4, 3, 5])
+        states = np.arange(space.size)
+        
+        assert np.array_equal(space.unravel(states), space.indices())
+        assert np.array_equal(space.ravel(space.unravel(states)), states)
+        assert np.array_equal(space.box([1, 0, 2], [2, 1, 3]), 
+                              np.sort(space.ravel([[i, j, k] for i in (1, 2) 
+                                                   for j in (0, 1) for k in (2, 3)])))
+        
+    def test_shared(self):
+        assert StateSpace.get([21, 11]) is StateSpace.get(np.array([21, 11]))
+        assert StateSpace.get([21, 11]) is not StateSpace.get([11, 21])
     
     
 if __name__ == '__main__':
@@ -0,0 +1,148 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from hydropt import Scenario
+from hydropt.constraints import TurbineConstraint
+from hydropt.core import OperatorCache, OperatorPipeline, InflowOperator, CoreAction, \
+    simple_trans_matrix, TRANSITION_CACHE
+
+from test_backward_induction import make_scenario
+
+
+class TestOperatorCache():
+    def test_hits_and_misses(self):
+        cache = OperatorCache()
+        
+        for key in [1, 2, 1, 1, 3, 2]:
+            cache.get(key, lambda: object())
+            
+        assert cache.hits == 3
+        assert cache.misses == 3
+        assert len(cache) == 3
+        
+    def test_least_recently_used_are_evicted(self):
+        cache = OperatorCache(max_bytes=2000)
+        
+        for key in [1, 2, 1, 3]:
+            cache.get(key, lambda: np.zeros(100))
+            
+        # 2 is the least recently used entry
+        assert cache.nbytes == 1600 and cache.evictions == 1
+        
+        cache.get(1, lambda: np.zeros(100))
+        cache.get(2, lambda: np.zeros(100))
+        assert (cache.hits, cache.misses, cache.evictions) == (2, 4, 2)
+        
+        # entries larger than the budget are not stored
+        cache.get(4, lambda: np.zeros(1000))
+        assert len(cache) == 2 and cache.nbytes == 1600
+        
+    def test_threads(self):
+        cache = OperatorCache(max_bytes=8000)
+        
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            entries = list(executor.map(
+                lambda key: cache.get(key % 20, lambda: np.full(50, key % 20)), range(400)))
+            
+        assert all(np.all(entry == key % 20) for key, entry in enumerate(entries))
+        assert cache.hits + cache.misses == 400
+        assert cache.nbytes == 8000 and len(cache) == 20
+        
+    def test_operators_shared_between_scenarios(self):
+        TRANSITION_CACHE.clear()
+        
+        base = make_scenario(2, n_steps=48)
+        base.run()
+        misses = TRANSITION_CACHE.misses
+        
+        # the constrained scenario only builds operators for the new flows
+        constraint = TurbineConstraint(base.power_plant.turbines[1], '2020-04-01T06', 
+                                       '2020-04-01T12', power_max=10e6)
+        scenario = Scenario(base.power_plant, base.underlyings, [constraint])
+        scenario.run()
+        
+        assert 0 < TRANSITION_CACHE.misses - misses < 9
+        assert TRANSITION_CACHE.hits >= 9
+        assert (base.core_action_series()[0][0].trans_matrix() 
+                is scenario.core_action_series()[0][0].trans_matrix())
+        
+    def test_quantised_flows(self):
+        volume = np.array([10.0, 4.0])
+        num_states = np.array([11, 5])
+        m = np.prod(num_states)
+        cache = OperatorCache()
+        
+        actions = [CoreAction(np.zeros((1, m)), np.array([q*np.ones(m), -0.7*np.ones(m)]),
+                              volume, num_states, cache=cache)
+                   for q in [2.5, 2.5 + 1e-13, 2.5 + 1e-6]]
+        
+        assert actions[0].trans_matrix() is actions[1].trans_matrix()
+        assert actions[0].trans_matrix() is not actions[2].trans_matrix()
+        
+    def test_identical_inflow_is_reused(self):
+        cache = OperatorCache()
+        volume = np.array([10.0, 4.0])
+        num_states = np.array([11, 5])
+        
+        operators = []
+        for inflow in [np.array([1.5, 0.5]), np.array([1.5, 0.5]), np.array([1.0, 0.5])]:
+            operators.append(cache.get(
+                InflowOperator.key(volume, num_states, inflow),
+                lambda: InflowOperator(volume, num_states, inflow)))
+        
+        assert operators[0] is operators[1]
+        assert operators[0] is not operators[2]
+        assert (cache.hits, cache.misses) == (1, 2)
+        
+    def test_inflow_operator_mass(self):
+        volume = np.array([10.0, 4.0])
+        num_states = np.array([11, 5])
+        inflow = np.array([1.5, 0.5])
+        
+        L = simple_trans_matrix(volume, num_states, -inflow)
+        operator = InflowOperator(volume, num_states, inflow)
+        
+        assert np.allclose(operator.mass, np.asarray(L.sum(axis=0)).ravel())
+        
+    def test_inflow_operator_leakage(self):
+        volume = np.array([10.0, 4.0])
+        num_states = np.array([11, 5])
+        inflow = np.array([1.5, 0.5])
+        m = np.prod(num_states)
+        
+        action = CoreAction(np.zeros((1, m)), np.array([2.5*np.ones(m), -0.7*np.ones(m)]),
+                            volume, num_states)
+        
+        L = simple_trans_matrix(volume, num_states, -inflow) @ action.trans_matrix()
+        operator = InflowOperator(volume, num_states, inflow)
+        leakage = operator.leakage(action)
+        
+        assert leakage.shape == (m, )
+        assert np.allclose(leakage, 1 - np.asarray(L.sum(axis=0)).ravel())
+        assert operator.leakage(action) is leakage
+        
+        
+class TestOperatorPipeline():
+    def test_builds_each_action_list_once(self):
+        a, b, c = [1], [2], [3]
+        action_series = [a, a, b, c, c, b, a]
+        built = []
+        
+        def build(actions):
+            built.append(actions[0])
+            return 10*actions[0]
+        
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pipeline = OperatorPipeline(action_series, build, executor, depth=2)
+            results = [pipeline.get(actions) for actions in reversed(action_series)]
+            
+        assert results == [10, 20, 30, 30, 20, 10, 10]
+        assert sorted(built) == [1, 2, 3]
+        
+    def test_without_executor(self):
+        a, b = [1], [2]
+        pipeline = OperatorPipeline([a, b, a], lambda actions: 10*actions[0])
+        
+        assert pipeline.get(b) == 20
+        assert pipeline.get(a) == 10
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from hydropt import Basin, Outflow, Turbine, PowerPlant, Standing, MinPower, MaxPower, \
+    Scenario, Underlyings, load_spot_data
+
+from test_backward_induction import make_power_plant
+
+
+def make_spot_scenario(num_basins, dtype, n_steps=24*14):
+    data = load_spot_data()
+    
+    time = data.index[:n_steps].to_numpy().astype('datetime64[h]')
+    price = data.iloc[:n_steps, 2].to_numpy()
+    inflow_rate = 0.8*np.ones((n_steps, num_basins))
+    
+    return Scenario(make_power_plant(num_basins), 
+                    Underlyings(time, price, inflow_rate), dtype=dtype)
+
+
+def make_readme_power_plant():
+    """Power plant of the example in README.md."""
+    basin = Basin('basin_1', volume=75e6, num_states=101, levels=(1700, 1792),
+                  start_volume=60e6)
+    outflow = Outflow(outflow_level=1090)
+    turbine = Turbine('turbine_1', max_power=45e6, base_load=1e6, efficiency=0.8,
+                      upper_basin=basin, lower_basin=outflow,
+                      actions=[Standing(), MinPower(), MaxPower()])
+    return PowerPlant([basin], [turbine])
+
+
+class TestSinglePrecision():
+    @pytest.mark.parametrize('operator', ['sparse', 'stacked', 'tensor', None])
+    def test_valuation_close_to_double(self, operator):
+        for num_basins in [1, 2]:
+            reference = make_spot_scenario(num_basins, np.float64)
+            reference.run(operator=operator)
+            
+            scenario = make_spot_scenario(num_basins, np.float32)
+            scenario.run(operator=operator)
+            
+            assert scenario.core_actions_
+            assert all(action.dtype == np.float32 
+                       for actions in scenario.core_actions_.values() 
+                       for action in actions)
+            assert np.isclose(scenario.valuation(), reference.valuation(), rtol=1e-4)
+            
+    def test_penalty_overflow(self):
+        scenario = make_spot_scenario(1, np.float32, n_steps=24)
+        scenario.basin_limit_penalty = 1e38
+        
+        with pytest.raises(ValueError):
+            scenario.run()
+            
+    @pytest.mark.parametrize('column', range(3))
+    def test_full_year(self, column):
+        data = load_spot_data()
+        time = data.index.to_numpy().astype('datetime64[h]')
+        price = data.iloc[:, column].to_numpy()
+        underlyings = Underlyings(time, price, 5*np.ones((len(price), 1)))
+        
+        valuations = []
+        for dtype in [np.float64, np.float32]:
+            scenario = Scenario(make_readme_power_plant(), underlyings, dtype=dtype)
+            scenario.run()
+            valuations.append(scenario.valuation())
+            
+        assert np.isclose(valuations[1], valuations[0], rtol=2e-4, atol=0)
@@ -0,0 +1,109 @@
+import numpy as np
+
+from hydropt import Scenario, Underlyings, RollingHorizon
+from hydropt.constraints import TurbineConstraint
+
+from test_backward_induction import make_scenario, assert_same_solution
+
+
+def window(scenario, start, n_steps):
+    underlyings = scenario.underlyings
+    steps = slice(start, start+n_steps)
+    return Underlyings(underlyings.time[steps], underlyings.price_curve[steps],
+                       underlyings.inflow_rate[steps])
+
+
+def make_constraints(power_plant):
+    return [TurbineConstraint(power_plant.turbines[0], '2020-04-02T00', 
+                              '2020-04-02T06', power_max=0)]
+
+
+class TestRollingHorizon():
+    def test_shifted_window(self):
+        full = make_scenario(2)
+        constraints = make_constraints(full.power_plant)
+        rolling = RollingHorizon(full.power_plant, constraints)
+        
+        rolling.update(window(full, 0, 48))
+        scenario = rolling.update(window(full, 1, 48))
+        
+        reference = Scenario(full.power_plant, window(full, 1, 48), constraints)
+        reference.run()
+        
+        # the step appended to the window changes all values
+        assert scenario.steps_solved_ == 48
+        assert_same_solution(scenario, reference)
+        
+    def test_changed_prices(self):
+        full = make_scenario(2)
+        constraints = make_constraints(full.power_plant)
+        rolling = RollingHorizon(full.power_plant, constraints)
+        rolling.update(window(full, 0, 48))
+        
+        underlyings = window(full, 0, 48)
+        underlyings.price_curve = underlyings.price_curve.copy()
+        underlyings.price_curve[10] += 5
+        scenario = rolling.update(underlyings)
+        
+        reference = Scenario(full.power_plant, underlyings, constraints)
+        reference.run()
+        
+        assert scenario.steps_solved_ == 11
+        assert scenario.stale_steps_ == 0
+        assert_same_solution(scenario, reference)
+        
+    def test_latency_budget(self):
+        full = make_scenario(1)
+        constraints = make_constraints(full.power_plant)
+        rolling = RollingHorizon(full.power_plant, constraints)
+        rolling.update(window(full, 0, 48))
+        
+        rolling.step_time_ = 1.
+        scenario = rolling.update(window(full, 2, 48), latency_budget=5)
+        
+        # two new steps at the end and three at the start are solved
+        assert scenario.steps_solved_ == 5
+        assert scenario.stale_steps_ == 43
+        assert scenario.action_grid_.shape[0] == 48
+        
+        # the stale steps are solved by the next run without budget
+        scenario = rolling.update(window(full, 2, 48))
+        
+        reference = Scenario(full.power_plant, window(full, 2, 48), constraints)
+        reference.run()
+        
+        assert scenario.steps_solved_ == 46
+        assert scenario.stale_steps_ == 0
+        assert_same_solution(scenario, reference)
+        
+    def test_single_precision(self):
+        full = make_scenario(2)
+        rolling = RollingHorizon(full.power_plant, dtype='float32')
+        rolling.update(window(full, 0, 48))
+        
+        underlyings = window(full, 0, 48)
+        underlyings.price_curve = underlyings.price_curve.copy()
+        underlyings.price_curve[10] += 5
+        scenario = rolling.update(underlyings)
+        
+        assert scenario.dtype == 'float32'
+        assert scenario.value_grid_.dtype == 'float32'
+        assert scenario.steps_solved_ == 11
+        assert all(action.dtype == 'float32' 
+                   for actions in rolling.core_actions.values() for action in actions)
+        
+    def test_bounded_inflow_cache(self):
+        for num_basins in [1, 2]:
+            full = make_scenario(num_basins)
+            rolling = RollingHorizon(full.power_plant, max_cache_bytes=2**20)
+            
+            # forecasts with new inflows at every step and update
+            for k in range(5):
+                underlyings = window(full, k, 24)
+                underlyings.inflow_rate = underlyings.inflow_rate \
+                    * (1 + 0.01*(24*k + np.arange(24)))[:, None]
+                rolling.update(underlyings)
+            
+            cache = rolling.inflow_cache
+            assert 0 < cache.nbytes <= 2**20
+            assert cache.evictions > 0
@@ -0,0 +1,30 @@
+import numpy as np
+
+from hydropt.core import TensorTransition, trans_matrix, simple_trans_matrix
+
+
+class TestTensorTransition():
+    vols = np.array([10.0, 4.0, 7.0])
+    num_states = np.array([11, 5, 8])
+    
+    def test_state_dependent_throughput(self):
+        rng = np.random.default_rng(0)
+        m = np.prod(self.num_states)
+        q = [3*rng.normal(size=m), rng.normal(size=m), np.zeros(m)]
+        value = rng.normal(size=m)
+        
+        L = trans_matrix(self.vols, self.num_states, q)
+        operator = TensorTransition(self.vols, self.num_states, q)
+        
+        assert np.allclose(operator.propagate(value), L.T.dot(value))
+        
+    def test_constant_throughput(self):
+        rng = np.random.default_rng(1)
+        m = np.prod(self.num_states)
+        q = np.array([2.3, -0.9, 1.0])
+        value = rng.normal(size=m)
+        
+        L = simple_trans_matrix(self.vols, self.num_states, q)
+        operator = TensorTransition(self.vols, self.num_states, q)
+        
+        assert np.allclose(operator.propagate(value), L.T.dot(value))